@@ -5,7 +5,7 @@ import io
 # Устанавливаем кодировку для вывода в консоль
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, g, make_response, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, date, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -14,18 +14,85 @@ import os
 import csv
 import secrets
 import re
-from io import StringIO, BytesIO
+import json
+import uuid
+import codecs
+import time
+import hashlib
+import heapq
+import struct
+import gzip
+import shutil
+import threading
+import queue
+import atexit
+import mmap
+import bisect
+import array
+from io import StringIO
 from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import traceback
+import tempfile
+import itertools
 import io as io_module
 
+# Необязательные зависимости экспорта: без них недоступны только соответствующие форматы
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Без fcntl (Windows) запись лога звонков сериализуется только внутри процесса
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # Конфигурация приложения
 class Config:
     SECRET_KEY = 'malvin_vet_secret_key_2024'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///malvin_vet.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///malvin_vet.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'uploads'
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    EMERGENCY_LOGS_FOLDER = 'emergency_logs'
+    EMERGENCY_LOG_MAX_BYTES = 5 * 1024 * 1024  # Размер файла лога, после которого следующая пачка пишется в новый файл
+    EMERGENCY_LOG_BATCH_SIZE = 500  # Записей лога за одну запись на диск
+    EMERGENCY_LOG_FLUSH_INTERVAL = 0.2  # Секунд ожидания пачки записей лога после первой
+    EMERGENCY_LOG_FSYNC = 'batch'  # 'batch' - fsync каждой пачки, 'interval' - не чаще EMERGENCY_LOG_FSYNC_INTERVAL, 'never' - на усмотрение ОС
+    EMERGENCY_LOG_FSYNC_INTERVAL = 5  # Секунд между fsync при EMERGENCY_LOG_FSYNC = 'interval'
+    LOGS_PAGE_SIZE = 30  # Дней на странице логов
+    LOG_ENTRIES_PAGE_SIZE = 50  # Записей дня за одну подгрузку
+    EMERGENCY_LOG_FILES = True  # Дублировать звонки из таблицы call_event в файлы emergency_logs
+    CALLS_PAGE_SIZE = 50  # Звонков на странице поиска в логах
+    LOG_SEARCH_LIMIT = 100  # Найденных записей лога в одном ответе
+    LOG_SEARCH_CACHE_BYTES = 64 * 1024 * 1024  # Распакованные .gz-файлы лога в памяти процесса для поиска
+    MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1GB: файл импорта читается потоком с диска
+    ARCHIVE_PAGE_SIZE = 50  # Строк архива на одну подгрузку
+    API_PAGE_SIZE = 100  # Строк на страницу /api/analyses по умолчанию
+    API_MAX_PAGE_SIZE = 1000
+    EVENTS_POLL_INTERVAL = 2  # Секунд между проверками новых событий в потоке SSE
+    # Каждая открытая главная страница занимает поток сервера на время соединения SSE.
+    # Встроенный сервер разработки (threaded) запускает поток на соединение, поэтому
+    # при большом числе открытых вкладок нужен gunicorn с gevent или потоками.
+    EVENTS_STREAM_TIMEOUT = 300  # Секунд до переподключения клиента к потоку
+    CHANGES_PAGE_SIZE = 1000  # Записей журнала изменений на один ответ /api/changes
+    CHANGES_MAX_PAGE_SIZE = 10000
+    CHANGE_EVENTS_TTL_HOURS = 24  # Сколько хранятся события живого обновления
+    LIVE_ROWS_LIMIT = 200  # Строк за один запрос живого обновления
+    IMPORT_BATCH_SIZE = 5000  # Строк CSV на один пакет вставки
+    IMPORT_WORKERS = 2  # Фоновых потоков импорта
+    EXPORT_BATCH_SIZE = 1000  # Строк, читаемых из базы и отдаваемых клиенту за раз
+    IMPORT_ENGINE = 'pandas'  # 'pandas' - векторный импорт, 'rows' - построчный
+    DASHBOARD_CACHE_SIZE = 128  # Вариантов главной страницы в кеше процесса
     DEFAULT_DOCTORS = [
         'Волков И.Р.',
         'Федосов М.А.', 
@@ -56,7 +123,7 @@ app = Flask(__name__)
 app.config.from_object(Config)
 
 # Создаем необходимые директории
-for folder in [app.config['UPLOAD_FOLDER'], 'emergency_logs']:
+for folder in [app.config['UPLOAD_FOLDER'], app.config['EMERGENCY_LOGS_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
 db = SQLAlchemy(app)
@@ -94,9 +161,8 @@ class Doctor(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class Analysis(db.Model):
-    """Модель анализа"""
-    id = db.Column(db.Integer, primary_key=True)
+class AnalysisFields:
+    """Общие поля анализа для рабочей и архивной таблиц"""
     patient_id = db.Column(db.String(50))  # ID пациента
     client_surname = db.Column(db.String(100), nullable=False)
     pet_name = db.Column(db.String(100), nullable=False)
@@ -106,11 +172,118 @@ class Analysis(db.Model):
     call_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     notes = db.Column(db.Text)
     
+    @db.declared_attr
+    def doctor_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+
+class Analysis(AnalysisFields, db.Model):
+    """Модель анализа (рабочая таблица: актуальные и недавно обработанные)"""
+    __table_args__ = (
+        # Вкладки главной страницы, архивация и статистика
+        db.Index('ix_analysis_status_call_date', 'status', 'call_date'),
+        db.Index('ix_analysis_doctor_status_call_date', 'doctor_id', 'status', 'call_date'),
+        # Фильтр по дате создания
+        db.Index('ix_analysis_created_at', 'created_at'),
+        # Проверка дубликатов при добавлении и импорте
+        db.Index('ix_analysis_duplicate_check', 'client_surname', 'pet_name', 'created_at'),
+        # ID не переиспользуются: архивные строки сохраняют свой ID
+        {'sqlite_autoincrement': True},
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
     doctor = db.relationship('Doctor', backref='analyses')
 
+class ArchivedAnalysis(AnalysisFields, db.Model):
+    """Модель архивного анализа (холодная таблица)"""
+    __tablename__ = 'analysis_archive'
+    __table_args__ = (
+        # Вкладка архива: сортировка по дате обработки, фильтр по врачу
+        db.Index('ix_analysis_archive_call_date', 'call_date'),
+        db.Index('ix_analysis_archive_doctor_call_date', 'doctor_id', 'call_date'),
+        db.Index('ix_analysis_archive_created_at', 'created_at'),
+        db.Index('ix_analysis_archive_duplicate_check', 'client_surname', 'pet_name', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # ID из рабочей таблицы
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    doctor = db.relationship('Doctor')
+
+class DataVersion(db.Model):
+    """Версия данных главной страницы (общая для всех процессов)"""
+    __tablename__ = 'data_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ImportJob(db.Model):
+    """Фоновая задача импорта CSV"""
+    __tablename__ = 'import_job'
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)  # Имя файла у пользователя
+    path = db.Column(db.String(500), nullable=False)  # Копия файла в UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, default=0)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    bytes_read = db.Column(db.BigInteger, default=0)
+    rows = db.Column(db.Integer, default=0)
+    added = db.Column(db.Integer, default=0)
+    duplicates = db.Column(db.Integer, default=0)
+    empty = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    message = db.Column(db.Text)
+    created_by = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class ChangeEvent(db.Model):
+    """Событие изменения анализа для живого обновления главной страницы"""
+    __tablename__ = 'change_event'
+    __table_args__ = (
+        db.Index('ix_change_event_created_at', 'created_at'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # added, called, edited, deleted, archived, reload
+    analysis_id = db.Column(db.Integer)  # Пусто для массовых изменений (reload)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class ChangeLog(db.Model):
+    """Журнал изменений анализов для синхронизации внешних баз (записи только добавляются)"""
+    __tablename__ = 'change_log'
+    __table_args__ = ({'sqlite_autoincrement': True},)
+    
+    id = db.Column(db.Integer, primary_key=True)  # Курсор синхронизации
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    analysis_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class CallEvent(db.Model):
+    """Звонок по анализу: пишется в одной транзакции с отметкой анализа"""
+    __tablename__ = 'call_event'
+    __table_args__ = (
+        # Поиск звонков в логах: за период, по врачу и по пользователю за период
+        db.Index('ix_call_event_called_at', 'called_at'),
+        db.Index('ix_call_event_doctor_called_at', 'doctor_id', 'called_at'),
+        db.Index('ix_call_event_called_by_called_at', 'called_by', 'called_at'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, nullable=False)  # Анализ может быть удален, данные ниже сохраняются
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    called_by = db.Column(db.String(50))  # Пользователь, отметивший звонок; пусто для перенесенных из анализов
+    called_at = db.Column(db.DateTime, nullable=False)
+    patient_id = db.Column(db.String(50))
+    client_surname = db.Column(db.String(100), nullable=False)
+    pet_name = db.Column(db.String(100), nullable=False)
+    analysis_type = db.Column(db.String(50), nullable=False)
+    
+    doctor = db.relationship('Doctor')
+
 # Утилиты
 def generate_invite_code(length=10):
     """Генерирует случайный инвайт-код"""
@@ -163,29 +336,492 @@ def create_admin_users():
         print(f"[ERROR] Ошибка при создании администраторов: {str(e)}")
         raise
 
-def log_emergency_call(analysis):
-    """Создает лог-файл с информацией о звонке"""
-    today = date.today().strftime('%Y-%m-%d')
-    filepath = os.path.join('emergency_logs', f'emergency_{today}.txt')
-    
-    log_entry = f"""
-{'='*60}
-ВРЕМЯ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-ВЛАДЕЛЕЦ: {analysis.client_surname}
-КЛИЧКА: {analysis.pet_name}
-АНАЛИЗ: {analysis.analysis_type}
-ВРАЧ: {analysis.doctor.name if analysis.doctor else 'Не указан'}
-ID ПАЦИЕНТА: {analysis.patient_id or 'Не указан'}
-СТАТУС: Обработан
-{'='*60}
-"""
-    
+# Лог звонков: одна JSON-запись на строку в emergency_ГГГГ-ММ-ДД[.N].jsonl.
+# Файл дня переходит на следующий номер N при превышении EMERGENCY_LOG_MAX_BYTES,
+# закрытые файлы (прошлые дни и переполненные) сжимаются в .gz. Старые дни
+# в текстовом формате (emergency_ГГГГ-ММ-ДД.txt) читаются как раньше.
+# Рядом с каждым файлом лежит индекс <файл>.idx - смещения начала записей
+# в распакованном содержимом (8 байт на запись): число записей - это размер
+# индекса / 8, а страница записей читается без чтения всего файла.
+LOG_INDEX_ITEM = struct.Struct('<Q')
+LOG_SEGMENT = re.compile(r'^emergency_(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.(txt|jsonl)(\.gz)?$')
+LOG_LINE_START = re.compile(rb'^(?=[^\r\n])', re.MULTILINE)
+LOG_TEXT_ENTRY_START = re.compile(rb'\r?\n={60}\r?\n' + re.escape('ВРЕМЯ:'.encode('utf-8')))
+LOG_RECORD_LABELS = [
+    ('client_surname', 'ВЛАДЕЛЕЦ'),
+    ('pet_name', 'КЛИЧКА'),
+    ('analysis_type', 'АНАЛИЗ'),
+    ('doctor', 'ВРАЧ'),
+    ('patient_id', 'ID ПАЦИЕНТА'),
+    ('called_by', 'ОТМЕТИЛ'),
+]
+LOG_LOCK_NAME = '.lock'
+_LOG_STOP = object()
+_log_writer_lock = threading.Lock()
+_log_folder_lock = threading.Lock()  # Потоки процесса; без fcntl (Windows) - единственная блокировка
+_log_writer = {'day': None, 'synced_at': 0.0, 'queue': None, 'thread': None, 'pid': None}
+
+def emergency_log_record(analysis, called_by):
+    """Запись лога о звонке (врач должен быть загружен вместе с анализом)"""
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'analysis_id': analysis.id,
+        'doctor_id': analysis.doctor_id,
+        'doctor': analysis.doctor.name if analysis.doctor else None,
+        'client_surname': analysis.client_surname,
+        'pet_name': analysis.pet_name,
+        'analysis_type': analysis.analysis_type,
+        'patient_id': analysis.patient_id,
+        'called_by': called_by,
+        'called_at': analysis.call_date.isoformat() if analysis.call_date else None,
+        'created_at': analysis.created_at.isoformat() if analysis.created_at else None,
+    }
+
+def log_segment_path(day, seq=0):
+    """Путь к открытому (несжатому) JSONL-файлу лога дня с номером seq"""
+    suffix = f'.{seq}' if seq else ''
+    return os.path.join(Config.EMERGENCY_LOGS_FOLDER, f'emergency_{day}{suffix}.jsonl')
+
+def log_index_path(path):
+    """Путь к индексу смещений файла лога; у сжатого файла индекс прежний"""
+    if path.endswith('.gz'):
+        path = path[:-len('.gz')]
+    return path + '.idx'
+
+def open_log_segment(path):
+    """Открывает файл лога на чтение в байтах, сжатый - с распаковкой на лету"""
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def build_log_index(path):
+    """Строит индекс смещений записей полным проходом по файлу лога.
+    
+    Нужен только для файлов без индекса (записанных до его появления)
+    и для индекса, отставшего от файла после сбоя записи. Вызывается под
+    блокировкой каталога логов; индекс заменяется целиком через os.replace.
+    """
+    with open_log_segment(path) as f:
+        content = f.read()
+    pattern = LOG_TEXT_ENTRY_START if '.txt' in os.path.basename(path) else LOG_LINE_START
+    offsets = [match.start() for match in pattern.finditer(content)]
+    
+    index_path = log_index_path(path)
+    with open(index_path + '.tmp', 'wb') as f:
+        f.write(b''.join(LOG_INDEX_ITEM.pack(offset) for offset in offsets))
+    os.replace(index_path + '.tmp', index_path)
+
+def log_index_stale(path, index_path):
+    """Индекса нет или он старше файла лога"""
+    return not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path)
+
+def refresh_log_index(path):
+    """Перестраивает устаревший индекс; вызывается под блокировкой каталога логов"""
+    index_path = log_index_path(path)
+    if log_index_stale(path, index_path):
+        build_log_index(path)
+    return index_path
+
+def ensure_log_index(path):
+    """Путь к актуальному индексу файла лога (для кода вне блокировки каталога).
+    
+    Индекс отстает от файла и между двумя записями write_log_batch, поэтому
+    проверка повторяется и индекс перестраивается под блокировкой: запись
+    успевает закончиться, и перестройка не теряет и не дублирует смещения.
+    """
+    index_path = log_index_path(path)
+    if not log_index_stale(path, index_path):
+        return index_path
+    with lock_log_folder():
+        return refresh_log_index(path)
+
+def compress_log_segment(path):
+    """Сжимает закрытый файл лога в .gz под блокировкой каталога; индекс и время изменения сохраняются"""
+    refresh_log_index(path)
+    stat = os.stat(path)
+    with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    # Время изменения не новее индекса, иначе индекс будет перестроен
+    os.utime(path + '.gz.tmp', (stat.st_atime, stat.st_mtime))
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+def log_day_segments():
+    """Файлы лога по дням: {день: [путь, ...]} в порядке записи (текстовый формат первым)"""
+    days = {}
+    with os.scandir(Config.EMERGENCY_LOGS_FOLDER) as entries:
+        for entry in entries:
+            match = LOG_SEGMENT.match(entry.name)
+            if match:
+                day, seq, kind, _ = match.groups()
+                days.setdefault(day, []).append((kind == 'jsonl', int(seq or 0), entry.path))
+    return {day: [path for _, _, path in sorted(segments)] for day, segments in days.items()}
+
+def compress_closed_logs(today):
+    """Сжимает несжатые файлы лога прошлых дней (под блокировкой каталога логов)"""
+    for day, segments in log_day_segments().items():
+        if day >= today:
+            continue
+        for path in segments:
+            if not path.endswith('.gz'):
+                try:
+                    compress_log_segment(path)
+                except OSError as e:
+                    print(f'Ошибка сжатия лога {path}: {e}')
+
+@contextmanager
+def lock_log_folder():
+    """Исключительная блокировка каталога логов для потоков и процессов приложения.
+    
+    Между процессами - flock файла блокировки (снимается при его закрытии).
+    Блокировка не повторная: код под ней вызывает refresh_log_index, а не
+    ensure_log_index.
+    """
+    with _log_folder_lock, open(os.path.join(Config.EMERGENCY_LOGS_FOLDER, LOG_LOCK_NAME), 'ab') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def current_log_segment(day):
+    """Открытый файл лога дня; вызывается под блокировкой каталога логов.
+    
+    Номер файла каждый раз определяется по каталогу: файл мог переключить другой
+    процесс. Переполненный файл сжимается и начинается следующий.
+    """
+    if _log_writer['day'] != day:
+        # Первая запись процесса или нового дня: закрываем прошлые дни
+        compress_closed_logs(day)
+        _log_writer['day'] = day
+    
+    segments = [(int(match.group(2) or 0), bool(match.group(4)))
+                for match in map(LOG_SEGMENT.match, os.listdir(Config.EMERGENCY_LOGS_FOLDER))
+                if match and match.group(1) == day and match.group(3) == 'jsonl']
+    seq, compressed = max(segments, default=(0, False))
+    path = log_segment_path(day, seq)
+    if compressed:
+        path = log_segment_path(day, seq + 1)
+    elif os.path.exists(path) and os.path.getsize(path) >= Config.EMERGENCY_LOG_MAX_BYTES:
+        compress_log_segment(path)
+        path = log_segment_path(day, seq + 1)
+    return path
+
+def log_sync_due():
+    """Нужен ли fsync очередной пачки по политике EMERGENCY_LOG_FSYNC"""
+    if Config.EMERGENCY_LOG_FSYNC == 'batch':
+        return True
+    if Config.EMERGENCY_LOG_FSYNC == 'interval':
+        return time.monotonic() - _log_writer['synced_at'] >= Config.EMERGENCY_LOG_FSYNC_INTERVAL
+    return False
+
+def write_log_batch(lines, sync):
+    """Дописывает пачку строк в лог текущего дня и их смещения в индекс.
+    
+    Пачка пишется одним вызовом write под блокировкой каталога, поэтому записи
+    разных процессов не перемешиваются.
+    """
+    with lock_log_folder():
+        path = current_log_segment(date.today().isoformat())
+        if os.path.exists(path):
+            refresh_log_index(path)
+        
+        # Лог записывается раньше индекса, иначе индекс окажется старше файла
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(b''.join(lines))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        offsets = []
+        for line in lines:
+            offsets.append(LOG_INDEX_ITEM.pack(offset))
+            offset += len(line)
+        with open(log_index_path(path), 'ab') as f:
+            f.write(b''.join(offsets))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+    if sync:
+        _log_writer['synced_at'] = time.monotonic()
+
+def run_log_writer(log_queue):
+    """Поток записи лога: собирает записи из очереди в пачки и пишет их на диск"""
+    stopping = False
+    while not stopping:
+        item = log_queue.get()
+        batch = []
+        deadline = time.monotonic() + Config.EMERGENCY_LOG_FLUSH_INTERVAL
+        while True:
+            if item is _LOG_STOP:
+                stopping = True
+                break
+            batch.append(item)
+            if len(batch) >= Config.EMERGENCY_LOG_BATCH_SIZE:
+                break
+            try:
+                item = log_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+        
+        if batch:
+            try:
+                # Перед остановкой процесса пачка сбрасывается на диск при любой политике, кроме 'never'
+                write_log_batch(batch, log_sync_due() or (stopping and Config.EMERGENCY_LOG_FSYNC != 'never'))
+            except Exception as e:
+                print(f'Ошибка при записи лога: {e}')
+        for _ in range(len(batch) + stopping):
+            log_queue.task_done()
+
+def log_writer_queue():
+    """Очередь потока записи лога; поток запускается при первом звонке процесса
+    (и заново в дочернем процессе после fork)"""
+    with _log_writer_lock:
+        thread = _log_writer['thread']
+        if _log_writer['pid'] != os.getpid() or not thread.is_alive():
+            _log_writer['queue'] = queue.Queue()
+            _log_writer['thread'] = threading.Thread(target=run_log_writer, args=(_log_writer['queue'],),
+                                                     name='emergency-log', daemon=True)
+            _log_writer['thread'].start()
+            _log_writer['pid'] = os.getpid()
+        return _log_writer['queue']
+
+def log_emergency_call(record):
+    """Ставит запись о звонке в очередь записи лога; запрос не ждет диска"""
     try:
-        with open(filepath, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        log_writer_queue().put(line)
     except Exception as e:
         print(f'Ошибка при записи лога: {e}')
 
+def flush_emergency_log():
+    """Ждет, пока все поставленные в очередь записи лога окажутся в файле"""
+    if _log_writer['pid'] == os.getpid():
+        _log_writer['queue'].join()
+
+def stop_log_writer():
+    """Дописывает очередь лога и останавливает поток записи при завершении процесса"""
+    with _log_writer_lock:
+        thread = _log_writer['thread']
+        if _log_writer['pid'] != os.getpid() or not thread.is_alive():
+            return
+        _log_writer['queue'].put(_LOG_STOP)
+    thread.join()
+
+atexit.register(stop_log_writer)
+
+def log_record_count(path):
+    """Число записей файла лога по размеру индекса"""
+    return os.path.getsize(ensure_log_index(path)) // LOG_INDEX_ITEM.size
+
+def list_log_files():
+    """Метаданные логов по дням от новых к старым: только stat, содержимое не читается"""
+    log_files = []
+    for day, segments in log_day_segments().items():
+        try:
+            log_files.append({
+                'date': day,
+                'files': len(segments),
+                'compressed': all(path.endswith('.gz') for path in segments),
+                'record_count': sum(log_record_count(path) for path in segments),
+                'size': sum(os.path.getsize(path) for path in segments)
+            })
+        except OSError as e:
+            print(f'Ошибка чтения лога за {day}: {e}')
+    log_files.sort(key=lambda log: log['date'], reverse=True)
+    return log_files
+
+def parse_log_entry(data):
+    """Запись лога для просмотра: время и строки данных (JSONL или старый текстовый формат)"""
+    text = data.decode('utf-8', errors='replace').strip()
+    if text.startswith('{'):
+        record = json.loads(text)
+        return {
+            'time': record.get('time', '').replace('T', ' '),
+            'lines': [f"{label}: {record.get(key) or 'Не указан'}" for key, label in LOG_RECORD_LABELS],
+            'record': record
+        }
+    
+    entry = {'time': '', 'lines': [], 'record': None}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line == '=' * 60:
+            continue
+        if line.startswith('ВРЕМЯ:'):
+            entry['time'] = line.replace('ВРЕМЯ:', '').strip()
+        else:
+            entry['lines'].append(line)
+    return entry
+
+def read_segment_entries(path, offset, limit):
+    """Записи файла лога с номера offset: читается limit смещений индекса и один участок файла"""
+    with open(ensure_log_index(path), 'rb') as f:
+        f.seek(offset * LOG_INDEX_ITEM.size)
+        data = f.read((limit + 1) * LOG_INDEX_ITEM.size)
+    offsets = [item[0] for item in LOG_INDEX_ITEM.iter_unpack(data)]
+    if not offsets:
+        return []
+    
+    # Смещение записи после последней нужной - граница участка
+    with open_log_segment(path) as f:
+        f.seek(offsets[0])
+        if len(offsets) > limit:
+            chunk = f.read(offsets[limit] - offsets[0])
+            offsets = offsets[:limit]
+        else:
+            chunk = f.read()
+    
+    bounds = [position - offsets[0] for position in offsets] + [len(chunk)]
+    return [parse_log_entry(chunk[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+def read_log_entries(day, offset, limit):
+    """Записи лога дня с номера offset по всем его файлам.
+    
+    Возвращает (записи, всего записей в дне); None вместо записей, если лога за день нет.
+    """
+    segments = log_day_segments().get(day)
+    if not segments:
+        return None, 0
+    
+    entries = []
+    total = 0
+    skip = offset
+    for path in segments:
+        count = log_record_count(path)
+        total += count
+        if skip >= count:
+            skip -= count
+            continue
+        if len(entries) < limit:
+            entries.extend(read_segment_entries(path, skip, limit - len(entries)))
+        skip = 0
+    return entries, total
+
+def generate_log_day(segments):
+    """Распакованное содержимое файлов лога дня по частям"""
+    for path in segments:
+        with open_log_segment(path) as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+
+# Поиск по логам: незакрытый файл дня отображается в память (mmap), закрытые .gz
+# распаковываются один раз и держатся в кеше процесса. Совпадения ищутся
+# регулярным выражением прямо по байтам, границы записи берутся из индекса
+# смещений, и в строки Python разбираются только найденные записи.
+_log_search_cache = OrderedDict()
+_log_search_cache_lock = threading.Lock()
+
+def log_search_pattern(query):
+    """Регулярное выражение по байтам UTF-8 без учета регистра, в том числе для кириллицы"""
+    parts = []
+    for char in query:
+        variants = sorted({re.escape(variant.encode('utf-8')) for variant in (char, char.lower(), char.upper())})
+        parts.append(variants[0] if len(variants) == 1 else b'(?:' + b'|'.join(variants) + b')')
+    return re.compile(b''.join(parts))
+
+def read_log_offsets(index_path):
+    """Смещения записей из индекса файла лога (массив uint64)"""
+    offsets = array.array('Q')
+    with open(index_path, 'rb') as f:
+        offsets.frombytes(f.read())
+    if sys.byteorder == 'big':
+        offsets.byteswap()  # Индекс хранится в little-endian
+    return offsets
+
+def cached_log_content(path):
+    """Распакованное содержимое закрытого .gz-файла лога (файл не меняется, кеш по mtime)"""
+    mtime = os.path.getmtime(path)
+    with _log_search_cache_lock:
+        entry = _log_search_cache.get(path)
+        if entry is not None and entry[0] == mtime:
+            _log_search_cache.move_to_end(path)
+            return entry[1]
+    
+    with gzip.open(path, 'rb') as f:
+        content = f.read()
+    with _log_search_cache_lock:
+        _log_search_cache[path] = (mtime, content)
+        size = sum(len(data) for _, data in _log_search_cache.values())
+        while size > Config.LOG_SEARCH_CACHE_BYTES and len(_log_search_cache) > 1:
+            _, (_, data) = _log_search_cache.popitem(last=False)
+            size -= len(data)
+    return content
+
+def open_log_search_buffer(path):
+    """Индекс и содержимое файла лога для поиска: (смещения, буфер, mmap или None).
+    
+    Открытый файл дня отображается в память под блокировкой каталога логов,
+    чтобы индекс и отображенная часть файла описывали одни и те же записи.
+    """
+    if path.endswith('.gz'):
+        return read_log_offsets(ensure_log_index(path)), cached_log_content(path), None
+    
+    with lock_log_folder():
+        offsets = read_log_offsets(refresh_log_index(path))
+        if os.path.getsize(path) == 0:
+            return offsets, b'', None
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return offsets, mapped, mapped
+
+def log_entry_matches(entry, needle):
+    """Проверяет совпадение в данных записи (ключи JSON в поиске не участвуют)"""
+    if entry['record'] is not None:
+        values = [str(value) for value in entry['record'].values() if value is not None]
+    else:
+        values = entry['lines']
+    return needle in ' '.join(values).lower()
+
+def search_segment(path, pattern, needle):
+    """Найденные записи файла лога: (всего записей в файле, [(номер записи, запись), ...])"""
+    offsets, buffer, mapped = open_log_search_buffer(path)
+    matches = []
+    try:
+        position = 0
+        match = pattern.search(buffer, position)
+        while match and offsets:
+            number = max(bisect.bisect_right(offsets, match.start()) - 1, 0)
+            start = offsets[number]
+            end = offsets[number + 1] if number + 1 < len(offsets) else len(buffer)
+            entry = parse_log_entry(buffer[start:end])
+            if log_entry_matches(entry, needle):
+                matches.append((number, entry))
+            # Следующее совпадение ищется после конца найденной записи
+            position = max(end, match.end())
+            match = pattern.search(buffer, position)
+    finally:
+        if mapped is not None:
+            mapped.close()
+    return len(offsets), matches
+
+def search_logs(query, limit):
+    """Записи логов, содержащие query, от новых к старым.
+    
+    Возвращает (записи, обрезан ли результат по limit); у записи есть date
+    и offset - номер в дне для /api/logs/<day>.
+    """
+    pattern = log_search_pattern(query)
+    needle = query.lower()
+    results = []
+    for day, segments in sorted(log_day_segments().items(), reverse=True):
+        day_matches = []
+        first_number = 0
+        for path in segments:
+            count, matches = search_segment(path, pattern, needle)
+            for number, entry in matches:
+                day_matches.append(dict(entry, date=day, offset=first_number + number))
+            first_number += count
+        results.extend(reversed(day_matches))
+        if len(results) > limit:
+            return results[:limit], True
+    return results, False
+
+def get_current_user():
+    """Текущий пользователь: загружается один раз за запрос и хранится в flask.g"""
+    if 'current_user' not in g:
+        username = session.get('username')
+        g.current_user = User.query.filter_by(username=username).first() if username else None
+    return g.current_user
+
 # Декораторы для проверки прав
 def login_required(f):
     """Декоратор для проверки авторизации"""
@@ -205,7 +841,7 @@ def admin_required(f):
             flash('Пожалуйста, войдите в систему', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = get_current_user()
         if not user or user.role not in ['admin', 'super_admin']:
             flash('Доступ запрещен. Требуются права администратора', 'danger')
             return redirect(url_for('index'))
@@ -221,7 +857,7 @@ def super_admin_required(f):
             flash('Пожалуйста, войдите в систему', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = get_current_user()
         if not user or user.role != 'super_admin':
             flash('Доступ запрещен. Требуются права суперадминистратора', 'danger')
             return redirect(url_for('index'))
@@ -237,7 +873,7 @@ def doctor_or_admin_required(f):
             flash('Пожалуйста, войдите в систему', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = get_current_user()
         if not user or user.role not in ['doctor', 'admin', 'super_admin']:
             flash('Доступ запрещен. Требуются права врача или администратора', 'danger')
             return redirect(url_for('index'))
@@ -253,7 +889,7 @@ def user_or_doctor_required(f):
             flash('Пожалуйста, войдите в систему', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = get_current_user()
         if not user or user.role not in ['user', 'doctor', 'admin', 'super_admin']:
             flash('Доступ запрещен. Требуются права пользователя или врача', 'danger')
             return redirect(url_for('index'))
@@ -269,7 +905,7 @@ def user_required(f):
             flash('Пожалуйста, войдите в систему', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.filter_by(username=session.get('username')).first()
+        user = get_current_user()
         if not user:
             flash('Доступ запрещен. Пользователь не найден', 'danger')
             return redirect(url_for('index'))
@@ -277,9 +913,134 @@ def user_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def upgrade_analysis_table():
+    """Пересоздает таблицу analysis с AUTOINCREMENT в базах, созданных до архивной таблицы"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    
+    with db.engine.begin() as conn:
+        table_sql = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'analysis'"
+        ).scalar()
+        if not table_sql or 'AUTOINCREMENT' in table_sql.upper():
+            return
+        
+        # Индексы и триггеры пересоздаются вместе с новой таблицей
+        dependents = conn.exec_driver_sql(
+            "SELECT type, name FROM sqlite_master "
+            "WHERE tbl_name = 'analysis' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+        ).all()
+        for kind, name in dependents:
+            conn.exec_driver_sql(f'DROP {kind.upper()} "{name}"')
+        
+        columns = ', '.join(column.name for column in Analysis.__table__.columns)
+        conn.exec_driver_sql('ALTER TABLE analysis RENAME TO analysis_legacy')
+        Analysis.__table__.create(conn)
+        conn.exec_driver_sql(f'INSERT INTO analysis ({columns}) SELECT {columns} FROM analysis_legacy')
+        conn.exec_driver_sql('DROP TABLE analysis_legacy')
+    
+    print("[SUCCESS] Таблица analysis обновлена для архивной таблицы")
+
+def ensure_indexes():
+    """Создает недостающие индексы в уже существующей базе"""
+    for model in (Analysis, ArchivedAnalysis, CallEvent):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# Полнотекстовый поиск (SQLite FTS5) по полям анализа
+SEARCH_COLUMNS = ('client_surname', 'pet_name', 'analysis_type', 'notes', 'patient_id')
+SEARCH_TABLES = ('analysis', 'analysis_archive')
+SEARCH_MIN_WORD = 3  # Более короткие слова и числа ищутся подстрокой через LIKE
+_search_index_state = {}
+
+def create_search_index(conn, table, rebuild=False):
+    """Создает FTS5-таблицу {table}_fts и триггеры, синхронизирующие ее с table"""
+    fts = f'{table}_fts'
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{col}' for col in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{col}' for col in SEARCH_COLUMNS)
+    
+    exists = conn.exec_driver_sql(
+        f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{fts}'"
+    ).first()
+    conn.exec_driver_sql(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {columns},
+            content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});
+        END""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END""")
+    # Триггер срабатывает только при изменении полей поиска: смена статуса
+    # и даты обработки (массовые UPDATE) не трогает FTS-индекс
+    trigger = conn.exec_driver_sql(
+        f"SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = '{fts}_update'"
+    ).scalar()
+    if trigger and 'UPDATE OF' not in trigger:
+        conn.exec_driver_sql(f'DROP TRIGGER {fts}_update')
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});
+        END""")
+    if rebuild or not exists:
+        conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+def ensure_search_index(rebuild=False):
+    """Создает FTS5-индексы поиска для рабочей и архивной таблиц"""
+    _search_index_state.clear()
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    
+    try:
+        with db.engine.begin() as conn:
+            for table in SEARCH_TABLES:
+                create_search_index(conn, table, rebuild)
+    except Exception as e:
+        print(f"[WARNING] Полнотекстовый поиск недоступен, используется LIKE: {str(e)}")
+        return False
+    
+    return True
+
+def has_search_index(model=Analysis):
+    """Проверяет наличие FTS5-индекса таблицы (результат кешируется в процессе)"""
+    fts = f'{model.__tablename__}_fts'
+    if fts not in _search_index_state:
+        ready = False
+        if db.engine.dialect.name == 'sqlite':
+            ready = db.session.execute(
+                db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': fts}
+            ).first() is not None
+        _search_index_state[fts] = ready
+    return _search_index_state[fts]
+
+def is_substring_word(token):
+    """Числа (ID пациента ищут по фрагменту) и короткие слова FTS не ищет, только LIKE"""
+    return token.isdigit() or len(token) < SEARCH_MIN_WORD
+
+def build_match_query(search_term):
+    """Строит выражение MATCH: слова запроса как префиксы, кроме чисел и коротких слов"""
+    tokens = re.findall(r'\w+', search_term)
+    return ' '.join(f'"{token}"*' for token in tokens if not is_substring_word(token))
+
+def search_like_condition(model, term):
+    """Поиск подстроки term по полям поиска (без индекса, регистр - только для латиницы)"""
+    pattern = f"%{term}%"
+    return db.or_(*(getattr(model, column).ilike(pattern) for column in SEARCH_COLUMNS))
+
 def initialize_database():
     """Инициализация базы данных с начальными данными"""
     db.create_all()
+    upgrade_analysis_table()
+    ensure_indexes()
+    ensure_search_index()
     
     if Doctor.query.count() == 0:
         for doc_name in Config.DEFAULT_DOCTORS:
@@ -291,36 +1052,546 @@ def initialize_database():
     
     # Создаем администраторов если их нет
     create_admin_users()
+    fail_interrupted_import_jobs()
+    backfill_change_log()
+    backfill_call_events()
+    
+    # Сбрасываем кеши главной страницы, построенные до запуска
+    bump_data_version()
+    db.session.commit()
 
-def apply_filters(query, search_term, date_filter):
-    """Применяет фильтры поиска и даты к запросу"""
-    if search_term:
-        search_pattern = f"%{search_term}%"
-        query = query.filter(
-            db.or_(
-                Analysis.client_surname.ilike(search_pattern),
-                Analysis.pet_name.ilike(search_pattern),
-                Analysis.analysis_type.ilike(search_pattern),
-                Analysis.notes.ilike(search_pattern),
-                Analysis.patient_id.ilike(search_pattern)
-            )
-        )
+def day_range(day):
+    """Полуоткрытый интервал [начало дня, начало следующего дня)"""
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def parse_filter_date(value):
+    """Парсит дату фильтра в формате ДД.ММ.ГГГГ"""
+    return datetime.strptime(value, '%d.%m.%Y').date()
+
+def validate_filter_dates(*values):
+    """Проверяет даты фильтра в API (apply_filters сообщает об ошибке через flash)"""
+    for value in values:
+        if value:
+            try:
+                parse_filter_date(value)
+            except ValueError:
+                raise ValueError(f'Неверный формат даты: {value}. Используйте ДД.ММ.ГГГГ')
+
+def apply_filters(query, search_term, date_filter, date_from='', date_to='', model=Analysis):
+    """Применяет фильтры поиска, даты и диапазона дат к запросу по model"""
+    words = re.findall(r'\w+', search_term) if search_term else []
+    if words and has_search_index(model):
+        # Слова ищутся по FTS как префиксы, числа и короткие слова - подстрокой
+        match_query = build_match_query(search_term)
+        if match_query:
+            fts = f'{model.__tablename__}_fts'
+            query = query.filter(model.id.in_(
+                db.text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :match_query')
+                .bindparams(match_query=match_query)
+                .columns(db.column('rowid'))
+            ))
+        for word in filter(is_substring_word, words):
+            query = query.filter(search_like_condition(model, word))
+    elif search_term:
+        query = query.filter(search_like_condition(model, search_term))
     
+    # Даты сравниваются диапазонами по created_at, чтобы работал индекс
     if date_filter:
         try:
-            date_obj = datetime.strptime(date_filter, '%d.%m.%Y').date()
-            query = query.filter(db.func.date(Analysis.created_at) == date_obj)
+            start, end = day_range(parse_filter_date(date_filter))
+            query = query.filter(model.created_at >= start, model.created_at < end)
         except ValueError:
             flash(f'Неверный формат даты: {date_filter}. Используйте ДД.ММ.ГГГГ', 'warning')
     
+    if date_from:
+        try:
+            start, _ = day_range(parse_filter_date(date_from))
+            query = query.filter(model.created_at >= start)
+        except ValueError:
+            flash(f'Неверный формат даты: {date_from}. Используйте ДД.ММ.ГГГГ', 'warning')
+    
+    if date_to:
+        try:
+            _, end = day_range(parse_filter_date(date_to))
+            query = query.filter(model.created_at < end)
+        except ValueError:
+            flash(f'Неверный формат даты: {date_to}. Используйте ДД.ММ.ГГГГ', 'warning')
+    
     return query
 
-def get_analysis_statistics(actual_analyses, processed_analyses, doctors):
-    """Собирает статистику по анализам"""
+def expired_condition(week_ago):
+    """Условие для анализов, обработанных раньше границы архивации"""
+    return db.and_(
+        Analysis.status == 'processed',
+        Analysis.call_date < week_ago
+    )
+
+def move_to_archive(condition):
+    """Переносит анализы под условием в архивную таблицу, возвращает их количество.
+    
+    Перенос выполняется двумя запросами INSERT ... SELECT и DELETE в текущей
+    транзакции; commit делает вызывающий код.
+    """
+    columns = [column.name for column in Analysis.__table__.columns]
+    archived_at = db.literal(datetime.utcnow(), db.DateTime)
+    db.session.execute(
+        db.insert(ArchivedAnalysis).from_select(
+            columns + ['archived_at'],
+            db.select(*[Analysis.__table__.c[name] for name in columns], archived_at).where(condition)
+        )
+    )
+    db.session.execute(
+        db.insert(ChangeEvent).from_select(
+            ['kind', 'analysis_id', 'created_at'],
+            db.select(db.literal('archived'), Analysis.id, archived_at).where(condition)
+        )
+    )
+    log_changes_where('upsert', Analysis, condition)
+    result = db.session.execute(
+        db.delete(Analysis).where(condition).execution_options(synchronize_session='fetch')
+    )
+    return result.rowcount
+
+def restore_from_archive():
+    """Возвращает все архивные анализы в рабочую таблицу (без commit)"""
+    columns = [column.name for column in Analysis.__table__.columns]
+    db.session.execute(
+        db.insert(Analysis).from_select(
+            columns,
+            db.select(*[ArchivedAnalysis.__table__.c[name] for name in columns])
+        )
+    )
+    result = db.session.execute(db.delete(ArchivedAnalysis))
+    return result.rowcount
+
+def reset_analyses():
+    """Возвращает все анализы в статус "Актуальные", возвращает число сброшенных.
+    
+    Архив возвращается в рабочую таблицу, затем один UPDATE меняет только
+    строки, которые отличаются от актуальных; они же попадают в журнал
+    синхронизации. commit делает вызывающий код.
+    """
+    restore_from_archive()
+    condition = db.or_(
+        Analysis.status.is_distinct_from('actual'),
+        Analysis.is_called.is_distinct_from(False),
+        Analysis.call_date.isnot(None)
+    )
+    log_changes_where('upsert', Analysis, condition)
+    result = db.session.execute(
+        db.update(Analysis).where(condition)
+        .values(status='actual', is_called=False, call_date=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+def archive_expired_analyses():
+    """Переносит в архив анализы, обработанные более 7 дней назад"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    condition = expired_condition(week_ago)
+    
+    # Дешевая проверка по индексу, чтобы не брать блокировку записи впустую
+    if not db.session.query(Analysis.id).filter(condition).first():
+        return 0
+    
+    count = move_to_archive(condition)
+    bump_data_version()
+    db.session.commit()
+    return count
+
+# Кеш главной страницы, инвалидируемый версией данных из базы
+DATA_VERSION_ID = 1
+_dashboard_cache = OrderedDict()
+_dashboard_cache_lock = threading.Lock()
+
+def bump_data_version():
+    """Увеличивает версию данных в текущей транзакции (без commit).
+    
+    Версия хранится в базе, поэтому изменение видят все процессы приложения.
+    Новая строка начинается с метки времени, чтобы версия не повторилась
+    после пересоздания базы.
+    """
+    result = db.session.execute(
+        db.update(DataVersion)
+        .where(DataVersion.id == DATA_VERSION_ID)
+        .values(version=DataVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(DataVersion(id=DATA_VERSION_ID, version=int(time.time() * 1000)))
+
+# Операция журнала синхронизации для вида события
+CHANGE_LOG_OPS = {'added': 'upsert', 'called': 'upsert', 'edited': 'upsert',
+                  'archived': 'upsert', 'deleted': 'delete'}
+
+def log_changes(op, analysis_ids):
+    """Записывает операции в журнал синхронизации в текущей транзакции (без commit)"""
+    now = datetime.utcnow()
+    db.session.execute(db.insert(ChangeLog), [
+        {'op': op, 'analysis_id': analysis_id, 'created_at': now}
+        for analysis_id in analysis_ids
+    ])
+
+def log_changes_where(op, model, condition=db.true()):
+    """Записывает операции для анализов model под условием одним INSERT ... SELECT (без commit)"""
+    db.session.execute(
+        db.insert(ChangeLog).from_select(
+            ['op', 'analysis_id', 'created_at'],
+            db.select(db.literal(op), model.id, db.literal(datetime.utcnow(), db.DateTime)).where(condition)
+        )
+    )
+
+def record_change(kind, analysis_ids=(None,)):
+    """Записывает события изменения в текущей транзакции (без commit).
+    
+    События отдельных анализов попадают и в журнал синхронизации change_log.
+    Заодно удаляет события старше CHANGE_EVENTS_TTL_HOURS: запись все равно
+    идет, а чтение потока SSE остается коротким; журнал синхронизации не чистится.
+    """
+    now = datetime.utcnow()
+    db.session.execute(db.insert(ChangeEvent), [
+        {'kind': kind, 'analysis_id': analysis_id, 'created_at': now}
+        for analysis_id in analysis_ids
+    ])
+    if kind in CHANGE_LOG_OPS:
+        log_changes(CHANGE_LOG_OPS[kind], analysis_ids)
+    db.session.execute(
+        db.delete(ChangeEvent)
+        .where(ChangeEvent.created_at < now - timedelta(hours=Config.CHANGE_EVENTS_TTL_HOURS))
+        .execution_options(synchronize_session=False)
+    )
+
+def backfill_change_log():
+    """Заполняет пустой журнал синхронизации всеми анализами, чтобы since=0 давал полный снимок"""
+    if db.session.query(ChangeLog.id).first() is not None:
+        return
+    log_changes_where('upsert', Analysis)
+    log_changes_where('upsert', ArchivedAnalysis)
+    db.session.commit()
+
+def backfill_call_events():
+    """Заполняет пустую таблицу звонков уже обработанными анализами (без автора отметки)"""
+    if db.session.query(CallEvent.id).first() is not None:
+        return
+    columns = ['analysis_id', 'doctor_id', 'called_at', 'patient_id', 'client_surname', 'pet_name', 'analysis_type']
+    for model in (Analysis, ArchivedAnalysis):
+        db.session.execute(db.insert(CallEvent).from_select(columns, db.select(
+            model.id, model.doctor_id, model.call_date, model.patient_id,
+            model.client_surname, model.pet_name, model.analysis_type
+        ).where(model.is_called.is_(True), model.call_date.isnot(None)).order_by(model.call_date)))
+    db.session.commit()
+
+def get_data_version():
+    """Текущая версия данных"""
+    version = db.session.query(DataVersion.version).filter_by(id=DATA_VERSION_ID).scalar()
+    return version or 0
+
+def dashboard_etag(cache_key, version):
+    """ETag главной страницы для ключа кеша и версии данных"""
+    return hashlib.sha1(repr((version,) + cache_key).encode('utf-8')).hexdigest()
+
+def get_cached_dashboard(cache_key, version):
+    """HTML главной страницы из кеша, если он построен для этой версии данных"""
+    with _dashboard_cache_lock:
+        entry = _dashboard_cache.get(cache_key)
+        if entry is None or entry[0] != version:
+            return None
+        _dashboard_cache.move_to_end(cache_key)
+        return entry[1]
+
+def store_cached_dashboard(cache_key, version, html):
+    """Сохраняет HTML главной страницы, вытесняя самые старые варианты"""
+    with _dashboard_cache_lock:
+        _dashboard_cache[cache_key] = (version, html)
+        _dashboard_cache.move_to_end(cache_key)
+        while len(_dashboard_cache) > Config.DASHBOARD_CACHE_SIZE:
+            _dashboard_cache.popitem(last=False)
+
+def dashboard_response(html, etag):
+    """Ответ с ETag; при совпадении If-None-Match возвращает 304"""
+    response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def find_analysis_or_404(analysis_id):
+    """Ищет анализ в рабочей таблице, затем в архиве"""
+    analysis = db.session.get(Analysis, analysis_id)
+    if analysis is None:
+        analysis = ArchivedAnalysis.query.get_or_404(analysis_id)
+    return analysis
+
+def find_existing_analyses(client_surname, pet_name, analysis_type, doctor_id, day):
+    """Анализы с теми же данными за тот же день в рабочей и архивной таблицах"""
+    day_start, day_end = day_range(day)
+    existing_analyses = []
+    for model in (Analysis, ArchivedAnalysis):
+        existing_analyses.extend(model.query.filter(
+            db.and_(
+                model.client_surname == client_surname,
+                model.pet_name == pet_name,
+                model.analysis_type == analysis_type,
+                model.doctor_id == doctor_id,
+                model.created_at >= day_start,
+                model.created_at < day_end
+            )
+        ).all())
+    return existing_analyses
+
+def encode_archive_cursor(analysis):
+    """Курсор страницы архива: дата обработки и ID последней строки"""
+    return f"{analysis.call_date.isoformat()}|{analysis.id}"
+
+def decode_archive_cursor(cursor):
+    """Разбирает курсор архива, возвращает (call_date, id)"""
+    try:
+        call_date, analysis_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(call_date), int(analysis_id)
+    except ValueError:
+        raise ValueError('Неверный курсор страницы')
+
+def paginate_archive(query, cursor, limit):
+    """Keyset-пагинация архива по (call_date, id) в порядке убывания"""
+    if cursor:
+        call_date, analysis_id = decode_archive_cursor(cursor)
+        # Сравнение кортежей SQLite ведет по индексу call_date, а не сканирует его с начала
+        query = query.filter(db.tuple_(ArchivedAnalysis.call_date, ArchivedAnalysis.id) < (call_date, analysis_id))
+    
+    rows = query.order_by(ArchivedAnalysis.call_date.desc(), ArchivedAnalysis.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_archive_cursor(rows[-1]) if has_more else None
+    return rows, next_cursor
+
+# Поля, доступные в /api/analyses
+API_FIELDS = ('id', 'patient_id', 'client_surname', 'pet_name', 'analysis_type', 'status',
+              'is_called', 'call_date', 'created_at', 'updated_at', 'notes',
+              'doctor_id', 'doctor', 'archived_at')
+API_STATUSES = ('actual', 'processed', 'archived')
+
+def parse_api_fields(value):
+    """Разбирает параметр fields=; id включается всегда (нужен для курсора)"""
+    if not value:
+        return list(API_FIELDS)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in API_FIELDS]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return ['id'] + [name for name in fields if name != 'id']
+
+def api_columns(model, fields):
+    """Колонки SELECT только для запрошенных полей"""
+    columns = []
+    for name in fields:
+        if name == 'doctor':
+            columns.append(Doctor.name.label('doctor'))
+        elif name == 'archived_at':
+            archived_at = model.archived_at if model is ArchivedAnalysis else db.null()
+            columns.append(archived_at.label('archived_at'))
+        else:
+            columns.append(getattr(model, name).label(name))
+    return columns
+
+def api_models(status):
+    """Таблицы, в которых ищутся анализы с данным статусом"""
+    if status == 'actual':
+        return (Analysis,)
+    if status == 'archived':
+        return (ArchivedAnalysis,)
+    return (Analysis, ArchivedAnalysis)
+
+def filter_analysis_query(query, model, filters, status):
+    """Фильтры главной страницы и статус для запроса по таблице model"""
+    doctor_id, search, date_filter, date_from, date_to = filters
+    if doctor_id:
+        query = query.filter(model.doctor_id == doctor_id)
+    if status in ('actual', 'processed'):
+        query = query.filter(model.status == status)
+    return apply_filters(query, search, date_filter, date_from, date_to, model=model)
+
+def paginate_analyses_api(filters, status, fields, cursor, limit):
+    """Keyset-пагинация по id в порядке убывания по рабочей и архивной таблицам.
+    
+    ID не повторяются между таблицами, поэтому страница собирается слиянием
+    двух запросов с LIMIT и курсором "id последней строки".
+    """
+    last_id = None
+    if cursor:
+        try:
+            last_id = int(cursor)
+        except ValueError:
+            raise ValueError('Неверный курсор страницы')
+    
+    rows = []
+    for model in api_models(status):
+        query = filter_analysis_query(model.query, model, filters, status)
+        if last_id is not None:
+            query = query.filter(model.id < last_id)
+        if 'doctor' in fields:
+            query = query.outerjoin(Doctor, model.doctor_id == Doctor.id)
+        rows.extend(query.with_entities(*api_columns(model, fields))
+                    .order_by(model.id.desc()).limit(limit + 1).all())
+    
+    rows.sort(key=lambda row: row.id, reverse=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = str(rows[-1].id) if has_more else None
+    
+    return [api_item(row, fields) for row in rows], next_cursor
+
+def api_item(row, fields):
+    """Строка запроса в словарь для JSON; даты в ISO 8601"""
+    item = {}
+    for name in fields:
+        value = getattr(row, name)
+        item[name] = value.isoformat() if isinstance(value, datetime) else value
+    return item
+
+def read_change_log(since, limit):
+    """Записи журнала синхронизации после курсора since в виде строк JSONL.
+    
+    Анализ, измененный несколько раз в пределах ответа, отдается один раз по
+    последней записи. Для upsert данные берутся из текущего состояния анализа;
+    если анализа уже нет, запись пропускается - его удаление придет дальше в журнале.
+    Возвращает (строки, следующий курсор, есть ли еще записи).
+    """
+    entries = db.session.query(ChangeLog.id, ChangeLog.op, ChangeLog.analysis_id).filter(
+        ChangeLog.id > since
+    ).order_by(ChangeLog.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], since, False
+    
+    latest = {}
+    for entry in entries:
+        latest[entry.analysis_id] = entry
+    
+    upsert_ids = [analysis_id for analysis_id, entry in latest.items() if entry.op == 'upsert']
+    items = {}
+    for model in (Analysis, ArchivedAnalysis):
+        if not upsert_ids:
+            break
+        rows = db.session.query(*api_columns(model, API_FIELDS)).outerjoin(
+            Doctor, model.doctor_id == Doctor.id
+        ).filter(model.id.in_(upsert_ids)).all()
+        for row in rows:
+            items[row.id] = api_item(row, API_FIELDS)
+    
+    lines = []
+    for entry in sorted(latest.values(), key=lambda entry: entry.id):
+        change = {'cursor': entry.id, 'op': entry.op, 'id': entry.analysis_id}
+        if entry.op == 'upsert':
+            if entry.analysis_id not in items:
+                continue
+            change['data'] = items[entry.analysis_id]
+        lines.append(json.dumps(change, ensure_ascii=False))
+    return lines, entries[-1].id, has_more
+
+def render_live_rows(ids, filters):
+    """Строки главной страницы для ID с учетом фильтров страницы.
+    
+    Для каждого ID возвращает вкладку (actual, processed, archived) и HTML строки;
+    строка, которой больше нет или которая не подходит под фильтры, получает tab = None.
+    """
+    doctor_id, search, date_filter, date_from, date_to = filters
+    found = {}
+    for model in (Analysis, ArchivedAnalysis):
+        if not ids:
+            break
+        query = model.query.filter(model.id.in_(ids))
+        if doctor_id:
+            query = query.filter_by(doctor_id=doctor_id)
+        query = apply_filters(query, search, date_filter, date_from, date_to, model=model)
+        for analysis in query.options(db.joinedload(model.doctor)).all():
+            tab = 'archived' if model is ArchivedAnalysis else analysis.status
+            found[analysis.id] = (tab, analysis)
+    
+    context = dict(selected_doctor=doctor_id, search_query=search, date_filter=date_filter,
+                   date_from=date_from, date_to=date_to, now=datetime.now())
+    rows = []
+    for analysis_id in ids:
+        tab, analysis = found.get(analysis_id, (None, None))
+        html = render_template('analysis_row.html', analysis=analysis, tab=tab, **context) if tab else ''
+        rows.append({'id': analysis_id, 'tab': tab, 'html': html})
+    return rows
+
+def get_tab_counts(filters):
+    """Счетчики вкладок главной страницы с фильтрами страницы"""
+    doctor_id, search, date_filter, date_from, date_to = filters
+    hot_query = Analysis.query
+    archive_query = ArchivedAnalysis.query
+    if doctor_id:
+        hot_query = hot_query.filter_by(doctor_id=doctor_id)
+        archive_query = archive_query.filter_by(doctor_id=doctor_id)
+    hot_query = apply_filters(hot_query, search, date_filter, date_from, date_to)
+    archive_query = apply_filters(archive_query, search, date_filter, date_from, date_to,
+                                  model=ArchivedAnalysis)
+    
+    counts = {'actual': 0, 'processed': 0}
+    for status, count in hot_query.with_entities(
+        Analysis.status, db.func.count(Analysis.id)
+    ).group_by(Analysis.status).all():
+        counts[status] = count
+    counts['archived'] = archive_query.count()
+    return counts
+
+def wants_json():
+    """Клиент ждет JSON (fetch с Accept: application/json), а не HTML-страницу"""
+    best = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+    return best == 'application/json'
+
+def row_action_response(analysis_id, message, category):
+    """Ответ действия со строкой анализа.
+    
+    Для fetch-запроса возвращает JSON с новым состоянием строки и счетчиками
+    вкладок, иначе - flash-сообщение и редирект на главную с фильтрами.
+    """
+    doctor_id = request.form.get('redirect_doctor_id', '')
+    search = request.form.get('redirect_search', '')
+    date_filter = request.form.get('redirect_date', '')
+    date_from = request.form.get('redirect_date_from', '')
+    date_to = request.form.get('redirect_date_to', '')
+    
+    if not wants_json():
+        flash(message, category)
+        return redirect(create_redirect_url(
+            doctor_id=doctor_id,
+            search=search,
+            date=date_filter,
+            date_from=date_from,
+            date_to=date_to
+        ))
+    
+    try:
+        validate_filter_dates(date_filter, date_from, date_to)
+        filters = (int(doctor_id) if doctor_id.isdigit() else None, search.strip(),
+                   date_filter.strip(), date_from.strip(), date_to.strip())
+        row = render_live_rows([analysis_id], filters)[0]
+        counts = get_tab_counts(filters)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e), 'category': 'danger'}), 400
+    
+    return jsonify({
+        'success': category != 'danger',
+        'message': message,
+        'category': category,
+        'data': {'row': row, 'counts': counts}
+    })
+
+def get_analysis_statistics(stats_query, doctors):
+    """Собирает статистику по анализам одним агрегирующим запросом"""
+    counts = {}
+    rows = stats_query.with_entities(
+        Analysis.doctor_id, Analysis.status, db.func.count(Analysis.id)
+    ).group_by(Analysis.doctor_id, Analysis.status).all()
+    for doctor_id, status, count in rows:
+        counts[(doctor_id, status)] = count
+    
     doctor_stats = []
     for doctor in doctors:
-        doctor_actual = len([a for a in actual_analyses if a.doctor_id == doctor.id])
-        doctor_processed = len([a for a in processed_analyses if a.doctor_id == doctor.id])
+        doctor_actual = counts.get((doctor.id, 'actual'), 0)
+        doctor_processed = counts.get((doctor.id, 'processed'), 0)
         doctor_total = doctor_actual + doctor_processed
         
         progress = int((doctor_processed / doctor_total * 100)) if doctor_total > 0 else 0
@@ -455,6 +1726,7 @@ def register():
             invite.used_by = user.id
             invite.used_at = datetime.utcnow()
             
+            bump_data_version()  # Число пользователей на главной странице
             db.session.commit()
             
             flash('Регистрация успешна! Теперь вы можете войти в систему.', 'success')
@@ -500,7 +1772,7 @@ def generate_invite():
             flash('Количество кодов должно быть от 1 до 50', 'danger')
             return redirect(url_for('admin_invite_codes'))
         
-        admin_user = User.query.filter_by(username=session.get('username')).first()
+        admin_user = get_current_user()
         
         generated_codes = []
         for _ in range(quantity):
@@ -574,7 +1846,7 @@ def admin_users():
 def toggle_user(user_id):
     """Активация/деактивация пользователя"""
     try:
-        current_user = User.query.filter_by(username=session.get('username')).first()
+        current_user = get_current_user()
         target_user = User.query.get_or_404(user_id)
         
         if target_user.username == session.get('username'):
@@ -603,7 +1875,7 @@ def toggle_user(user_id):
 def delete_user(user_id):
     """Удаление пользователя"""
     try:
-        current_user = User.query.filter_by(username=session.get('username')).first()
+        current_user = get_current_user()
         target_user = User.query.get_or_404(user_id)
         
         if target_user.username == session.get('username'):
@@ -617,6 +1889,7 @@ def delete_user(user_id):
         
         username = target_user.username
         db.session.delete(target_user)
+        bump_data_version()  # Число пользователей на главной странице
         db.session.commit()
         
         flash(f'Пользователь {username} удален', 'success')
@@ -702,47 +1975,56 @@ def index():
         doctor_id = request.args.get('doctor_id', type=int)
         search = request.args.get('search', '').strip()
         date_filter = request.args.get('date', '').strip()
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
         
-        # Получаем текущего пользователя
-        current_user = User.query.filter_by(username=session.get('username')).first()
-        
-        # Получаем количество пользователей
-        users_count = User.query.count()
+        # Переносим в архив анализы, обработанные более 7 дней назад
+        archive_expired_analyses()
         
-        # Рассчитываем границу для архивации
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        
-        # Основные запросы с учетом статусов
-        base_query = Analysis.query
+        # Получаем текущего пользователя
+        current_user = get_current_user()
+        
+        # Страница кешируется по пользователю и фильтрам до изменения версии данных.
+        # Шаблон показывает кнопки по роли из сессии, а "дней назад" считает по
+        # календарной дате now, поэтому обе входят в ключ.
+        # Страницу с ожидающими flash-сообщениями не берем из кеша и не сохраняем.
+        now = datetime.now()
+        cache_key = (session.get('username'), current_user.role if current_user else None, session.get('role'),
+                     doctor_id, search, date_filter, date_from, date_to, now.date().isoformat())
+        version = get_data_version()
+        etag = dashboard_etag(cache_key, version)
+        use_cache = not session.get('_flashes')
+        if use_cache:
+            if request.if_none_match.contains(etag):
+                return dashboard_response('', etag)
+            html = get_cached_dashboard(cache_key, version)
+            if html is not None:
+                return dashboard_response(html, etag)
+        
+        # Последнее событие до чтения данных: поток SSE начнется с него, и изменения
+        # между отрисовкой страницы и подключением EventSource не потеряются
+        last_event_id = db.session.query(db.func.max(ChangeEvent.id)).scalar() or 0
+        
+        # Количество пользователей показывается только администраторам
+        users_count = User.query.count() if current_user and current_user.role in ['admin', 'super_admin'] else 0
+        
+        # Рабочая таблица содержит только неархивные анализы
+        non_archive_query = Analysis.query
+        archive_query = ArchivedAnalysis.query
         if doctor_id:
-            base_query = base_query.filter_by(doctor_id=doctor_id)
-        
-        # Неархивные анализы
-        non_archive_query = base_query.filter(
-            db.or_(
-                Analysis.status == 'actual',
-                db.and_(
-                    Analysis.status == 'processed',
-                    Analysis.call_date >= week_ago
-                )
-            )
-        )
-        
-        # Архивные анализы
-        archive_query = base_query.filter(
-            db.and_(
-                Analysis.status == 'processed',
-                Analysis.call_date < week_ago
-            )
-        )
+            non_archive_query = non_archive_query.filter_by(doctor_id=doctor_id)
+            archive_query = archive_query.filter_by(doctor_id=doctor_id)
         
         # Применяем текстовый поиск и фильтр по дате
-        non_archive_query = apply_filters(non_archive_query, search, date_filter)
-        archive_query = apply_filters(archive_query, search, date_filter)
+        non_archive_query = apply_filters(non_archive_query, search, date_filter, date_from, date_to)
+        archive_query = apply_filters(archive_query, search, date_filter, date_from, date_to,
+                                      model=ArchivedAnalysis)
         
-        # Получаем данные
-        non_archived_analyses = non_archive_query.order_by(Analysis.created_at.desc()).all()
-        archived_analyses = archive_query.order_by(Analysis.call_date.desc()).all()
+        # Получаем данные (строки архива подгружаются отдельно через /api/archive)
+        non_archived_analyses = non_archive_query.options(
+            db.joinedload(Analysis.doctor)
+        ).order_by(Analysis.created_at.desc()).all()
+        archived_count = archive_query.count()
         
         # Разделяем неархивные анализы
         actual_analyses = [a for a in non_archived_analyses if a.status == 'actual']
@@ -753,25 +2035,32 @@ def index():
         
         # Статистика
         doctors = Doctor.query.order_by(Doctor.name).all()
-        doctor_stats = get_analysis_statistics(actual_analyses, processed_analyses, doctors)
+        doctor_stats = get_analysis_statistics(non_archive_query, doctors)
         
-        return render_template('index.html',
+        html = render_template('index.html',
                              actual_analyses=actual_analyses,
                              processed_analyses=processed_analyses,
-                             archived_analyses=archived_analyses,
                              doctors=doctors,
                              doctor_stats=doctor_stats,
                              total_analyses=len(non_archived_analyses),
                              actual_count=len(actual_analyses),
                              processed_count=len(processed_analyses),
-                             archived_count=len(archived_analyses),
+                             archived_count=archived_count,
                              selected_doctor=doctor_id,
                              search_query=search,
                              date_filter=date_filter,
-                             week_ago=week_ago,
-                             now=datetime.now(),
+                             date_from=date_from,
+                             date_to=date_to,
+                             now=now,
                              users_count=users_count,
-                             user=current_user)
+                             user=current_user,
+                             last_event_id=last_event_id,
+                             export_formats=available_export_formats())
+        
+        if not use_cache:
+            return html
+        store_cached_dashboard(cache_key, version, html)
+        return dashboard_response(html, etag)
     
     except Exception as e:
         flash(f'Ошибка при загрузке данных: {str(e)}', 'danger')
@@ -779,13 +2068,12 @@ def index():
         traceback.print_exc()
         
         # Возвращаем значения по умолчанию при ошибке
-        current_user = User.query.filter_by(username=session.get('username')).first() if session.get('username') else None
-        users_count = User.query.count()
+        current_user = get_current_user()
+        users_count = User.query.count() if current_user and current_user.role in ['admin', 'super_admin'] else 0
         
         return render_template('index.html', 
                               actual_analyses=[], 
                               processed_analyses=[], 
-                              archived_analyses=[],
                               doctors=[], 
                               doctor_stats=[],
                               total_analyses=0,
@@ -795,36 +2083,239 @@ def index():
                               selected_doctor=None,
                               search_query='',
                               date_filter='',
+                              date_from='',
+                              date_to='',
                               now=datetime.now(),
                               users_count=users_count,
-                              user=current_user)
+                              user=current_user,
+                              export_formats=available_export_formats())
+
+@app.route('/api/archive')
+@login_required
+def api_archive():
+    """Страница архивных анализов для ленивой вкладки архива"""
+    try:
+        doctor_id = request.args.get('doctor_id', type=int)
+        search = request.args.get('search', '').strip()
+        date_filter = request.args.get('date', '').strip()
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        cursor = request.args.get('cursor', '').strip()
+        limit = min(request.args.get('limit', Config.ARCHIVE_PAGE_SIZE, type=int), 200)
+        
+        archive_query = ArchivedAnalysis.query
+        if doctor_id:
+            archive_query = archive_query.filter_by(doctor_id=doctor_id)
+        archive_query = apply_filters(archive_query, search, date_filter, date_from, date_to,
+                                      model=ArchivedAnalysis)
+        
+        archived_analyses, next_cursor = paginate_archive(
+            archive_query.options(db.joinedload(ArchivedAnalysis.doctor)), cursor, max(limit, 1)
+        )
+        
+        html = render_template('archive_rows.html',
+                               archived_analyses=archived_analyses,
+                               selected_doctor=doctor_id,
+                               search_query=search,
+                               date_filter=date_filter,
+                               date_from=date_from,
+                               date_to=date_to,
+                               now=datetime.now())
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'html': html,
+                'count': len(archived_analyses),
+                'next_cursor': next_cursor
+            }
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/analyses')
+@user_or_doctor_required  # Могут все авторизованные пользователи
+def api_analyses():
+    """Анализы в JSON: фильтры главной страницы, курсор и выбор полей"""
+    try:
+        doctor_id = request.args.get('doctor_id', type=int)
+        search = request.args.get('search', '').strip()
+        date_filter = request.args.get('date', '').strip()
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        status = request.args.get('status', '').strip()
+        cursor = request.args.get('cursor', '').strip()
+        limit = request.args.get('limit', Config.API_PAGE_SIZE, type=int)
+        limit = min(max(limit, 1), Config.API_MAX_PAGE_SIZE)
+        fields = parse_api_fields(request.args.get('fields', '').strip())
+        
+        if status and status not in API_STATUSES:
+            raise ValueError(f'Неизвестный статус: {status}')
+        validate_filter_dates(date_filter, date_from, date_to)
+        
+        items, next_cursor = paginate_analyses_api(
+            (doctor_id, search, date_filter, date_from, date_to), status, fields, cursor, limit
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'items': items,
+                'count': len(items),
+                'next_cursor': next_cursor
+            }
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/changes')
+@user_or_doctor_required  # Могут все авторизованные пользователи
+def api_changes():
+    """Инкрементальная выгрузка изменений анализов в JSONL.
+    
+    Каждая строка - {"cursor", "op": "upsert", "id", "data"} или удаление
+    {"cursor", "op": "delete", "id"}. Следующий запрос делается с
+    since=X-Next-Cursor, пока X-Has-More равен 1. since=0 отдает все анализы.
+    """
+    try:
+        since = request.args.get('since', '0').strip() or '0'
+        try:
+            since = int(since)
+        except ValueError:
+            raise ValueError('Неверный курсор изменений')
+        limit = request.args.get('limit', Config.CHANGES_PAGE_SIZE, type=int)
+        limit = min(max(limit, 1), Config.CHANGES_MAX_PAGE_SIZE)
+        
+        lines, next_cursor, has_more = read_change_log(since, limit)
+        body = ''.join(line + '\n' for line in lines)
+        
+        return Response(body, mimetype='application/x-ndjson', headers={
+            'X-Next-Cursor': str(next_cursor),
+            'X-Has-More': '1' if has_more else '0',
+            'Cache-Control': 'no-cache'
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Поток событий изменений анализов (Server-Sent Events).
+    
+    События читаются из таблицы change_event, поэтому поток видит изменения,
+    сделанные любым процессом. Главная страница передает since - последнее
+    событие на момент отрисовки; после переподключения клиент продолжает
+    с Last-Event-ID. Соединение держит поток сервера до EVENTS_STREAM_TIMEOUT.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since', type=int)
+    if last_id is None:
+        last_id = db.session.query(db.func.max(ChangeEvent.id)).scalar() or 0
+    db.session.remove()
+    
+    def stream(last_id):
+        deadline = time.monotonic() + Config.EVENTS_STREAM_TIMEOUT
+        last_sent = time.monotonic()
+        yield f'retry: {int(Config.EVENTS_POLL_INTERVAL * 1000)}\n\n'
+        
+        while time.monotonic() < deadline:
+            events = db.session.query(
+                ChangeEvent.id, ChangeEvent.kind, ChangeEvent.analysis_id
+            ).filter(ChangeEvent.id > last_id).order_by(ChangeEvent.id).limit(500).all()
+            # Соединение не удерживается между проверками
+            db.session.remove()
+            
+            for event_id, kind, analysis_id in events:
+                data = json.dumps({'kind': kind, 'analysis_id': analysis_id})
+                yield f'id: {event_id}\nevent: change\ndata: {data}\n\n'
+                last_id = event_id
+                last_sent = time.monotonic()
+            
+            # Комментарий раз в 15 секунд не дает прокси закрыть соединение
+            if time.monotonic() - last_sent > 15:
+                yield ': ping\n\n'
+                last_sent = time.monotonic()
+            
+            time.sleep(Config.EVENTS_POLL_INTERVAL)
+    
+    return Response(stream_with_context(stream(last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/analyses/rows')
+@login_required
+def api_analysis_rows():
+    """Строки таблиц главной страницы и счетчики вкладок для живого обновления"""
+    try:
+        doctor_id = request.args.get('doctor_id', type=int)
+        search = request.args.get('search', '').strip()
+        date_filter = request.args.get('date', '').strip()
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        try:
+            ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            raise ValueError('Неверный список ID')
+        if len(ids) > Config.LIVE_ROWS_LIMIT:
+            raise ValueError(f'Не более {Config.LIVE_ROWS_LIMIT} строк за запрос')
+        validate_filter_dates(date_filter, date_from, date_to)
+        
+        filters = (doctor_id, search, date_filter, date_from, date_to)
+        rows = render_live_rows(ids, filters)
+        counts = get_tab_counts(filters)
+        
+        return jsonify({'success': True, 'data': {'rows': rows, 'counts': counts}})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
 
 # Обработка анализов
 @app.route('/analysis/<int:analysis_id>/mark_called', methods=['POST'])
 @user_or_doctor_required  # Могут врачи и обычные пользователи
 def mark_called(analysis_id):
     try:
-        analysis = Analysis.query.get_or_404(analysis_id)
+        analysis = Analysis.query.options(db.joinedload(Analysis.doctor)).get_or_404(analysis_id)
         
         if not analysis.is_called:
             analysis.is_called = True
             analysis.status = 'processed'
             analysis.call_date = datetime.utcnow()
+            
+            # Запись лога и сообщение готовятся до commit, пока объект не expired
+            log_record = emergency_log_record(analysis, session.get('username'))
+            client_info = f"{analysis.client_surname} ({analysis.pet_name})"
+            db.session.add(CallEvent(
+                analysis_id=analysis.id,
+                doctor_id=analysis.doctor_id,
+                called_by=session.get('username'),
+                called_at=analysis.call_date,
+                patient_id=analysis.patient_id,
+                client_surname=analysis.client_surname,
+                pet_name=analysis.pet_name,
+                analysis_type=analysis.analysis_type
+            ))
+            record_change('called', [analysis.id])
+            bump_data_version()
             db.session.commit()
             
-            log_emergency_call(analysis)
-            flash(f'Анализ для {analysis.client_surname} ({analysis.pet_name}) отмечен как обработанный', 'success')
+            if Config.EMERGENCY_LOG_FILES:
+                log_emergency_call(log_record)
+            message, category = f'Анализ для {client_info} отмечен как обработанный', 'success'
         else:
-            flash('Этот анализ уже был обработан ранее', 'info')
+            message, category = 'Этот анализ уже был обработан ранее', 'info'
     
     except Exception as e:
-        flash(f'Ошибка при отметке анализа: {str(e)}', 'danger')
+        db.session.rollback()
+        message, category = f'Ошибка при отметке анализа: {str(e)}', 'danger'
     
-    return redirect(create_redirect_url(
-        doctor_id=request.form.get('redirect_doctor_id', ''),
-        search=request.form.get('redirect_search', ''),
-        date=request.form.get('redirect_date', '')
-    ))
+    return row_action_response(analysis_id, message, category)
 
 @app.route('/analysis/add', methods=['GET', 'POST'])
 @admin_required  # Только админы и суперадмины
@@ -860,16 +2351,9 @@ def add_analysis():
                 return render_template('add_analysis.html', doctors=doctors)
             
             # Проверка дубликатов
-            check_date = created_at.date()
-            existing_analyses = Analysis.query.filter(
-                db.and_(
-                    Analysis.client_surname == client_surname,
-                    Analysis.pet_name == pet_name,
-                    Analysis.analysis_type == analysis_type,
-                    Analysis.doctor_id == doctor.id,
-                    db.func.date(Analysis.created_at) == check_date
-                )
-            ).all()
+            existing_analyses = find_existing_analyses(
+                client_surname, pet_name, analysis_type, doctor.id, created_at.date()
+            )
             
             # Проверяем точные дубликаты
             for existing in existing_analyses:
@@ -891,6 +2375,9 @@ def add_analysis():
             )
             
             db.session.add(new_analysis)
+            db.session.flush()  # Получаем ID анализа для события
+            record_change('added', [new_analysis.id])
+            bump_data_version()
             db.session.commit()
             
             flash(f'Анализ успешно добавлен для {client_surname} ({pet_name})', 'success')
@@ -898,7 +2385,9 @@ def add_analysis():
             return redirect(create_redirect_url(
                 doctor_id=request.form.get('redirect_doctor_id', ''),
                 search=request.form.get('redirect_search', ''),
-                date=request.form.get('redirect_date', '')
+                date=request.form.get('redirect_date', ''),
+                date_from=request.form.get('redirect_date_from', ''),
+                date_to=request.form.get('redirect_date_to', '')
             ))
         
         except Exception as e:
@@ -909,7 +2398,7 @@ def add_analysis():
 @app.route('/analysis/<int:analysis_id>/edit', methods=['GET', 'POST'])
 @user_or_doctor_required  # Могут врачи и обычные пользователи
 def edit_analysis(analysis_id):
-    analysis = Analysis.query.get_or_404(analysis_id)
+    analysis = find_analysis_or_404(analysis_id)
     doctors = Doctor.query.order_by(Doctor.name).all()
     
     if request.method == 'POST':
@@ -921,6 +2410,8 @@ def edit_analysis(analysis_id):
             analysis.doctor_id = request.form.get('doctor_id', type=int)
             analysis.notes = request.form.get('notes', '').strip()
             
+            record_change('edited', [analysis.id])
+            bump_data_version()
             db.session.commit()
             flash('Анализ успешно обновлен', 'success')
         
@@ -930,7 +2421,9 @@ def edit_analysis(analysis_id):
         return redirect(create_redirect_url(
             doctor_id=request.form.get('redirect_doctor_id', ''),
             search=request.form.get('redirect_search', ''),
-            date=request.form.get('redirect_date', '')
+            date=request.form.get('redirect_date', ''),
+            date_from=request.form.get('redirect_date_from', ''),
+            date_to=request.form.get('redirect_date_to', '')
         ))
     
     return render_template('edit_analysis.html', analysis=analysis, doctors=doctors)
@@ -939,22 +2432,21 @@ def edit_analysis(analysis_id):
 @admin_required  # Только админы и суперадмины
 def delete_analysis(analysis_id):
     try:
-        analysis = Analysis.query.get_or_404(analysis_id)
+        analysis = find_analysis_or_404(analysis_id)
         client_info = f"{analysis.client_surname} ({analysis.pet_name})"
         
+        record_change('deleted', [analysis.id])
         db.session.delete(analysis)
+        bump_data_version()
         db.session.commit()
         
-        flash(f'Анализ для {client_info} успешно удален', 'success')
+        message, category = f'Анализ для {client_info} успешно удален', 'success'
     
     except Exception as e:
-        flash(f'Ошибка при удалении анализа: {str(e)}', 'danger')
+        db.session.rollback()
+        message, category = f'Ошибка при удалении анализа: {str(e)}', 'danger'
     
-    return redirect(create_redirect_url(
-        doctor_id=request.form.get('redirect_doctor_id', ''),
-        search=request.form.get('redirect_search', ''),
-        date=request.form.get('redirect_date', '')
-    ))
+    return row_action_response(analysis_id, message, category)
 
 @app.route('/analysis/<int:analysis_id>/archive', methods=['POST'])
 @admin_required  # Только админы и суперадмины
@@ -963,44 +2455,33 @@ def archive_analysis(analysis_id):
         analysis = Analysis.query.get_or_404(analysis_id)
         
         if analysis.status == 'processed' and analysis.call_date:
-            # Сохраняем оригинальную дату обработки, просто уменьшаем на 8 дней для фильтрации
-            analysis.call_date = analysis.call_date - timedelta(days=8)
+            # Дата обработки сохраняется, время архивации пишется в archived_at
+            client_surname = analysis.client_surname
+            move_to_archive(Analysis.id == analysis.id)
+            bump_data_version()
             db.session.commit()
-            flash(f'Анализ для {analysis.client_surname} перемещен в архив', 'success')
+            message, category = f'Анализ для {client_surname} перемещен в архив', 'success'
         else:
-            flash('Только обработанные анализы можно перемещать в архив', 'warning')
+            message, category = 'Только обработанные анализы можно перемещать в архив', 'warning'
     
     except Exception as e:
-        flash(f'Ошибка при перемещении в архив: {str(e)}', 'danger')
+        db.session.rollback()
+        message, category = f'Ошибка при перемещении в архив: {str(e)}', 'danger'
     
-    return redirect(create_redirect_url(
-        doctor_id=request.form.get('redirect_doctor_id', ''),
-        search=request.form.get('redirect_search', ''),
-        date=request.form.get('redirect_date', '')
-    ))
+    return row_action_response(analysis_id, message, category)
 
 @app.route('/archive_old', methods=['POST'])
 @admin_required  # Только админы и суперадмины
 def archive_old():
     try:
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        fresh_analyses = Analysis.query.filter(
-            db.and_(
-                Analysis.status == 'processed',
-                Analysis.call_date >= week_ago
-            )
-        ).all()
-        
-        count = 0
-        for analysis in fresh_analyses:
-            # Сохраняем оригинальную дату обработки, просто уменьшаем на 8 дней для фильтрации
-            analysis.call_date = analysis.call_date - timedelta(days=8)
-            count += 1
-        
+        # Все обработанные анализы переносятся в архивную таблицу
+        count = move_to_archive(Analysis.status == 'processed')
+        bump_data_version()
         db.session.commit()
         flash(f'В архив перемещено {count} анализов', 'success')
     
     except Exception as e:
+        db.session.rollback()
         flash(f'Ошибка при архивировании: {str(e)}', 'danger')
     
     return redirect(url_for('index'))
@@ -1014,43 +2495,52 @@ def validate_csv_file(file):
     if not file.filename.lower().endswith('.csv'):
         raise ValueError('Пожалуйста, загрузите CSV файл с расширением .csv')
     
-    file.seek(0, 2)
-    file_size = file.tell()
-    file.seek(0)
-    
-    if file_size > 10 * 1024 * 1024:
-        raise ValueError('Файл слишком большой. Максимальный размер: 10MB')
-    
     return True
 
-def decode_csv_content(file_content):
-    """Декодирование содержимого CSV файла с разными кодировками"""
-    encodings = ['utf-8', 'cp1251', 'windows-1251', 'latin-1', 'iso-8859-1']
+CSV_ENCODINGS = ['utf-8', 'cp1251', 'latin-1']
+CSV_SNIFF_SIZE = 64 * 1024  # Байт для определения кодировки
+
+def detect_csv_encoding(head):
+    """Определяет кодировку CSV по первому блоку файла"""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
     
-    for encoding in encodings:
+    for encoding in CSV_ENCODINGS:
         try:
-            return file_content.decode(encoding)
+            # Блок может обрываться посреди многобайтного символа
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+            return encoding
         except UnicodeDecodeError:
             continue
     
-    raise UnicodeDecodeError('Не удалось прочитать файл. Сохраните файл в кодировке UTF-8')
+    raise ValueError('Не удалось прочитать файл. Сохраните файл в кодировке UTF-8')
+
+def open_csv_stream(stream):
+    """Открывает загруженный файл как текстовый поток без чтения в память целиком"""
+    head = stream.read(CSV_SNIFF_SIZE)
+    if not head.strip():
+        raise ValueError('Файл пуст')
+    
+    encoding = detect_csv_encoding(head)
+    stream.seek(0)
+    return io_module.TextIOWrapper(stream, encoding=encoding, newline='')
+
+CSV_TIME_FORMATS = [
+    '%d.%m.%Y %H:%M',
+    '%Y-%m-%d %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%H:%M %d.%m.%Y',
+    '%d.%m.%Y',
+    '%Y-%m-%d %H:%M',
+    '%d.%m.%Y %H:%M:%S',
+]
 
 def parse_creation_time(time_str, current_datetime):
     """Парсит строку времени из CSV"""
     if not time_str:
         return current_datetime
     
-    formats = [
-        '%d.%m.%Y %H:%M',
-        '%Y-%m-%d %H:%M:%S',
-        '%d/%m/%Y %H:%M',
-        '%H:%M %d.%m.%Y',
-        '%d.%m.%Y',
-        '%Y-%m-%d %H:%M',
-        '%d.%m.%Y %H:%M:%S',
-    ]
-    
-    for fmt in formats:
+    for fmt in CSV_TIME_FORMATS:
         try:
             return datetime.strptime(time_str, fmt)
         except ValueError:
@@ -1058,12 +2548,422 @@ def parse_creation_time(time_str, current_datetime):
     
     return current_datetime
 
+CSV_REQUIRED_COLUMNS = ['Врач', 'Фамилия', 'Кличка', 'Анализ']
+CSV_OPTIONAL_COLUMNS = ['ID пациента', 'Время создания', 'Примечания']
+
+def find_csv_columns(fieldnames):
+    """Сопоставляет колонки импорта с заголовками файла (в исходном, нижнем и верхнем регистре)"""
+    found_columns = {}
+    for col in CSV_REQUIRED_COLUMNS + CSV_OPTIONAL_COLUMNS:
+        col_variants = [col, col.lower(), col.upper()]
+        for variant in col_variants:
+            if variant in fieldnames:
+                found_columns[col] = variant
+                break
+    return found_columns
+
+def check_csv_columns(fieldnames):
+    """Находит колонки импорта, ValueError при отсутствии обязательных"""
+    found_columns = find_csv_columns(fieldnames)
+    missing_columns = [col for col in CSV_REQUIRED_COLUMNS if col not in found_columns]
+    if missing_columns:
+        raise ValueError(f'Отсутствуют обязательные колонки: {", ".join(missing_columns)}. '
+                         f'Найдены колонки: {", ".join(fieldnames)}')
+    return found_columns
+
+def duplicate_key(client_surname, pet_name, analysis_type, doctor_id, day, patient_id, notes):
+    """Ключ дубликата: те же данные анализа за тот же день"""
+    return (client_surname, pet_name, analysis_type, doctor_id, day, patient_id or '', notes or '')
+
+def load_duplicate_keys(start, end, client_surnames):
+    """Ключи дубликатов анализов клиентов, созданных в [start, end), из обеих таблиц"""
+    keys = set()
+    for model in (Analysis, ArchivedAnalysis):
+        rows = db.session.query(
+            model.client_surname, model.pet_name, model.analysis_type, model.doctor_id,
+            model.created_at, model.patient_id, model.notes
+        ).filter(
+            model.client_surname.in_(client_surnames),
+            model.created_at >= start,
+            model.created_at < end
+        ).all()
+        for client_surname, pet_name, analysis_type, doctor_id, created_at, patient_id, notes in rows:
+            keys.add(duplicate_key(client_surname, pet_name, analysis_type, doctor_id,
+                                   created_at.date(), patient_id, notes))
+    return keys
+
+def insert_imported_analyses(records):
+    """Вставляет пакет импорта и записывает изменения в текущей транзакции (без commit).
+    
+    Вставка идет через Core без ORM-обработки каждой строки. ID из AUTOINCREMENT
+    растут, поэтому новые анализы пакета - это строки с ID больше прежнего максимума.
+    """
+    last_id = db.session.query(db.func.max(Analysis.id)).scalar() or 0
+    db.session.execute(Analysis.__table__.insert(), records)
+    log_changes_where('upsert', Analysis, Analysis.id > last_id)
+    record_change('reload')
+    bump_data_version()
+
+def import_analysis_rows(rows, found_columns, batch_size=None, progress=None):
+    """Импортирует строки CSV пакетами и возвращает счетчики.
+    
+    Врачи загружаются один раз, ключи дубликатов - одним запросом на пакет
+    (по фамилиям и диапазону дат пакета). Дубликаты отсекаются в памяти,
+    анализы пакета вставляются одним executemany с commit после каждого пакета.
+    Предыдущие пакеты к этому моменту уже в базе, поэтому повторы внутри файла
+    тоже находятся, а память не растет с размером файла.
+    После каждого пакета вызывается progress(stats), если он передан.
+    """
+    batch_size = batch_size or Config.IMPORT_BATCH_SIZE
+    stats = {'rows': 0, 'added': 0, 'duplicates': 0, 'empty': 0, 'errors': 0}
+    started = time.perf_counter()
+    current_datetime = datetime.utcnow()
+    
+    doctors = dict(db.session.query(Doctor.name, Doctor.id).all())
+    
+    def value(row, column):
+        if column not in found_columns:
+            return ''
+        return (row.get(found_columns[column]) or '').strip()
+    
+    def insert_batch(batch):
+        # Новые врачи создаются одним запросом на пакет
+        new_names = {item['doctor_name'] for item in batch} - doctors.keys()
+        if new_names:
+            db.session.execute(db.insert(Doctor), [{'name': name} for name in sorted(new_names)])
+            doctors.update(db.session.query(Doctor.name, Doctor.id).filter(Doctor.name.in_(new_names)).all())
+        
+        days = [item['created_at'].date() for item in batch]
+        start, _ = day_range(min(days))
+        _, end = day_range(max(days))
+        known_keys = load_duplicate_keys(start, end, {item['client_surname'] for item in batch})
+        
+        records = []
+        for item in batch:
+            doctor_id = doctors[item.pop('doctor_name')]
+            key = duplicate_key(item['client_surname'], item['pet_name'], item['analysis_type'],
+                                doctor_id, item['created_at'].date(), item['patient_id'], item['notes'])
+            if key in known_keys:
+                stats['duplicates'] += 1
+                continue
+            known_keys.add(key)
+            item['doctor_id'] = doctor_id
+            records.append(item)
+        
+        try:
+            if records:
+                insert_imported_analyses(records)
+            db.session.commit()
+            stats['added'] += len(records)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ERROR] Ошибка вставки пакета импорта: {str(e)}")
+            stats['errors'] += len(records)
+            for name in new_names:
+                doctors.pop(name, None)
+        
+        if progress:
+            progress(stats)
+    
+    batch = []
+    for row in rows:
+        stats['rows'] += 1
+        try:
+            doctor_name = value(row, 'Врач')
+            client_surname = value(row, 'Фамилия')
+            pet_name = value(row, 'Кличка')
+            analysis_type = value(row, 'Анализ')
+            
+            # Проверяем обязательные поля
+            if not all([doctor_name, client_surname, pet_name, analysis_type]):
+                stats['empty'] += 1
+                continue
+            
+            patient_id = value(row, 'ID пациента')
+            creation_time = parse_creation_time(value(row, 'Время создания'), current_datetime)
+            batch.append({
+                'doctor_name': doctor_name,
+                'patient_id': patient_id or None,
+                'client_surname': client_surname,
+                'pet_name': pet_name,
+                'analysis_type': analysis_type,
+                'notes': value(row, 'Примечания'),
+                'status': 'actual',
+                'is_called': False,
+                'created_at': creation_time,
+                'updated_at': creation_time
+            })
+        except Exception:
+            stats['errors'] += 1
+            continue
+        
+        if len(batch) >= batch_size:
+            insert_batch(batch)
+            batch = []
+    
+    if batch:
+        insert_batch(batch)
+    
+    elapsed = time.perf_counter() - started
+    stats['elapsed'] = elapsed
+    stats['rate'] = stats['rows'] / elapsed if elapsed > 0 else 0
+    return stats
+
+def open_csv_reader(stream):
+    """DictReader по файлу импорта с очищенными заголовками и найденными колонками"""
+    csv_reader = csv.DictReader(open_csv_stream(stream), delimiter=',')
+    if csv_reader.fieldnames is None:
+        raise ValueError('Не удалось прочитать заголовки CSV файла')
+    
+    # Проверяем и нормализуем колонки
+    fieldnames = [col.strip() for col in csv_reader.fieldnames]
+    csv_reader.fieldnames = fieldnames
+    return csv_reader, check_csv_columns(fieldnames)
+
+# Векторный импорт через pandas
+IMPORT_KEY_COLUMNS = ['client_surname', 'pet_name', 'analysis_type', 'doctor_id', 'day', 'patient_id', 'notes']
+IMPORT_FRAME_COLUMNS = {
+    'Врач': 'doctor_name',
+    'Фамилия': 'client_surname',
+    'Кличка': 'pet_name',
+    'Анализ': 'analysis_type',
+    'ID пациента': 'patient_id',
+    'Время создания': 'created_at',
+    'Примечания': 'notes',
+}
+
+def infer_time_format(values):
+    """Формат 'Время создания' по первому непустому значению колонки"""
+    sample = next((value for value in values if value), None)
+    if sample is None:
+        return None
+    for fmt in CSV_TIME_FORMATS:
+        try:
+            datetime.strptime(sample, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+def parse_creation_times(values, time_format, current_datetime):
+    """Векторный разбор колонки времени в одном формате.
+    
+    Пустые значения получают время импорта; значения в другом формате
+    разбираются построчно через parse_creation_time.
+    """
+    parsed = pd.to_datetime(values, format=time_format, errors='coerce') if time_format \
+        else pd.Series(pd.NaT, index=values.index)
+    result = pd.Series(parsed.dt.to_pydatetime(), index=values.index, dtype=object)
+    
+    result[values == ''] = current_datetime
+    fallback = parsed.isna() & (values != '')
+    if fallback.any():
+        result[fallback] = [parse_creation_time(value, current_datetime) for value in values[fallback]]
+    return result
+
+def import_analysis_frame(text_stream, batch_size=None, progress=None):
+    """Импортирует CSV через pandas пакетами по batch_size строк и возвращает счетчики.
+    
+    Заголовки нормализуются как в find_csv_columns, формат 'Время создания'
+    определяется один раз на файл, дубликаты отсекаются anti-join с ключами
+    из базы (load_duplicate_keys), новые анализы вставляются одним executemany
+    на пакет. Как и csv.DictReader, лишние поля строк отбрасываются, а недостающие
+    считаются пустыми: usecols не дает C-движку пропускать такие строки, а
+    index_col=False - делать первую колонку индексом при запятой в конце строки.
+    Счетчики и progress(stats) совпадают с import_analysis_rows.
+    """
+    batch_size = batch_size or Config.IMPORT_BATCH_SIZE
+    stats = {'rows': 0, 'added': 0, 'duplicates': 0, 'empty': 0, 'errors': 0}
+    started = time.perf_counter()
+    current_datetime = datetime.utcnow()
+    time_format = None
+    
+    doctors = dict(db.session.query(Doctor.name, Doctor.id).all())
+    
+    chunks = pd.read_csv(text_stream, sep=',', dtype=str, keep_default_na=False, chunksize=batch_size,
+                         usecols=lambda name: True, index_col=False)
+    for chunk in chunks:
+        chunk.columns = [str(col).strip() for col in chunk.columns]
+        found_columns = check_csv_columns(list(chunk.columns))
+        stats['rows'] += len(chunk)
+        
+        frame = pd.DataFrame(index=chunk.index)
+        for col, field in IMPORT_FRAME_COLUMNS.items():
+            frame[field] = chunk[found_columns[col]].str.strip() if col in found_columns else ''
+        
+        # Проверяем обязательные поля
+        filled = (frame[['doctor_name', 'client_surname', 'pet_name', 'analysis_type']] != '').all(axis=1)
+        stats['empty'] += int((~filled).sum())
+        frame = frame[filled]
+        if frame.empty:
+            if progress:
+                progress(stats)
+            continue
+        
+        if time_format is None:
+            time_format = infer_time_format(frame['created_at'])
+        frame['created_at'] = parse_creation_times(frame['created_at'], time_format, current_datetime)
+        frame['day'] = [created_at.date() for created_at in frame['created_at']]
+        
+        # Новые врачи создаются одним запросом на пакет
+        new_names = set(frame['doctor_name']) - doctors.keys()
+        if new_names:
+            db.session.execute(db.insert(Doctor), [{'name': name} for name in sorted(new_names)])
+            doctors.update(db.session.query(Doctor.name, Doctor.id).filter(Doctor.name.in_(new_names)).all())
+        frame['doctor_id'] = frame['doctor_name'].map(doctors).astype('int64')
+        
+        # Повторы внутри пакета и anti-join с уже сохраненными анализами
+        unique = frame.drop_duplicates(subset=IMPORT_KEY_COLUMNS)
+        start, _ = day_range(min(unique['day']))
+        _, end = day_range(max(unique['day']))
+        known_keys = load_duplicate_keys(start, end, set(unique['client_surname']))
+        if known_keys:
+            known = pd.DataFrame(list(known_keys), columns=IMPORT_KEY_COLUMNS)
+            merged = unique.merge(known, on=IMPORT_KEY_COLUMNS, how='left', indicator=True)
+            unique = merged[merged['_merge'] == 'left_only']
+        stats['duplicates'] += len(frame) - len(unique)
+        
+        # Словари собираются из списков колонок: to_dict('records') заметно медленнее
+        records = [
+            {'doctor_id': doctor_id, 'patient_id': patient_id or None, 'client_surname': client_surname,
+             'pet_name': pet_name, 'analysis_type': analysis_type, 'notes': notes, 'status': 'actual',
+             'is_called': False, 'created_at': created_at, 'updated_at': created_at}
+            for doctor_id, patient_id, client_surname, pet_name, analysis_type, notes, created_at in zip(
+                unique['doctor_id'].tolist(), unique['patient_id'].tolist(), unique['client_surname'].tolist(),
+                unique['pet_name'].tolist(), unique['analysis_type'].tolist(), unique['notes'].tolist(),
+                unique['created_at'].tolist())
+        ]
+        
+        try:
+            if records:
+                insert_imported_analyses(records)
+            db.session.commit()
+            stats['added'] += len(records)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ERROR] Ошибка вставки пакета импорта: {str(e)}")
+            stats['errors'] += len(records)
+            for name in new_names:
+                doctors.pop(name, None)
+        
+        if progress:
+            progress(stats)
+    
+    elapsed = time.perf_counter() - started
+    stats['elapsed'] = elapsed
+    stats['rate'] = stats['rows'] / elapsed if elapsed > 0 else 0
+    return stats
+
+def format_import_message(stats):
+    """Итоговое сообщение импорта и его категория"""
+    messages = []
+    if stats['added'] > 0:
+        messages.append(f"[SUCCESS] Успешно добавлено {stats['added']} анализов")
+    else:
+        messages.append("[WARNING] Не удалось добавить анализы")
+    
+    if stats['duplicates'] > 0:
+        messages.append(f"пропущено {stats['duplicates']} дубликатов")
+    if stats['empty'] > 0:
+        messages.append(f"пропущено {stats['empty']} строк с пустыми полями")
+    if stats['errors'] > 0:
+        messages.append(f"ошибок: {stats['errors']}")
+    messages.append(f"скорость {stats['rate']:.0f} строк/с")
+    
+    return '. '.join(messages), 'success' if stats['added'] > 0 else 'warning'
+
+# Фоновые задачи импорта
+IMPORT_COUNTERS = ('rows', 'added', 'duplicates', 'empty', 'errors')
+import_executor = ThreadPoolExecutor(max_workers=Config.IMPORT_WORKERS, thread_name_prefix='import')
+
+def update_import_job(job_id, **values):
+    """Обновляет задачу импорта отдельным commit"""
+    db.session.execute(db.update(ImportJob).where(ImportJob.id == job_id).values(**values))
+    db.session.commit()
+
+def run_import_job(job_id):
+    """Выполняет задачу импорта в фоновом потоке"""
+    with app.app_context():
+        path = db.session.get(ImportJob, job_id).path
+        update_import_job(job_id, status='running', started_at=datetime.utcnow())
+        
+        try:
+            with open(path, 'rb') as stream:
+                def progress(stats):
+                    update_import_job(job_id, bytes_read=stream.tell(),
+                                      **{key: stats[key] for key in IMPORT_COUNTERS})
+                
+                if Config.IMPORT_ENGINE == 'pandas':
+                    stats = import_analysis_frame(open_csv_stream(stream), progress=progress)
+                else:
+                    csv_reader, found_columns = open_csv_reader(stream)
+                    stats = import_analysis_rows(csv_reader, found_columns, progress=progress)
+            
+            message, _ = format_import_message(stats)
+            update_import_job(job_id, status='done', message=message, bytes_read=os.path.getsize(path),
+                              finished_at=datetime.utcnow(),
+                              **{key: stats[key] for key in IMPORT_COUNTERS})
+        except Exception as e:
+            db.session.rollback()
+            if isinstance(e, UnicodeDecodeError):
+                message = 'Не удалось прочитать файл: кодировка меняется внутри файла. Сохраните файл в кодировке UTF-8'
+            else:
+                message = f'Ошибка при обработке CSV файла: {str(e)}'
+            print(f"[ERROR] Импорт {job_id}: {message}")
+            update_import_job(job_id, status='failed', message=message, finished_at=datetime.utcnow())
+        finally:
+            # Повторный импорт все равно требует новой загрузки файла
+            remove_import_file(path)
+
+def remove_import_file(path):
+    """Удаляет загруженный файл задачи импорта, если он еще есть"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def fail_interrupted_import_jobs():
+    """Задачи, прерванные перезапуском сервера, помечаются как неудачные, их файлы удаляются"""
+    interrupted = ImportJob.query.filter(ImportJob.status.in_(['queued', 'running']))
+    paths = [path for path, in interrupted.with_entities(ImportJob.path)]
+    count = interrupted.update({
+        'status': 'failed',
+        'message': 'Импорт прерван перезапуском сервера. Загрузите файл повторно: '
+                   'уже добавленные анализы будут пропущены как дубликаты',
+        'finished_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    for path in paths:
+        remove_import_file(path)
+    if count:
+        print(f"[WARNING] Прервано задач импорта: {count}")
+
+def import_job_data(job):
+    """Состояние задачи импорта для API"""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'progress': int(job.bytes_read * 100 / job.size) if job.size else 0,
+        'rows': job.rows,
+        'added': job.added,
+        'duplicates': job.duplicates,
+        'empty': job.empty,
+        'errors': job.errors,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
 @app.route('/upload', methods=['GET', 'POST'])
 @admin_required  # Только админы и суперадмины
 def upload_csv():
     if request.method == 'GET':
-        return render_template('upload.html')
+        job_id = request.args.get('job', '')
+        job = db.session.get(ImportJob, job_id) if job_id else None
+        return render_template('upload.html', job=job)
     
+    path = None
     try:
         if 'csv_file' not in request.files:
             flash('Файл не найден в запросе', 'danger')
@@ -1072,221 +2972,376 @@ def upload_csv():
         file = request.files['csv_file']
         validate_csv_file(file)
         
-        file_content = file.read()
-        if not file_content:
-            flash('Файл пуст', 'danger')
-            return redirect(url_for('upload_csv'))
-        
-        decoded_content = decode_csv_content(file_content)
-        csv_data = io_module.StringIO(decoded_content)
-        
-        # Читаем первую строку для проверки
-        first_line = csv_data.readline().strip()
-        if not first_line:
-            flash('CSV файл пуст', 'danger')
-            return redirect(url_for('upload_csv'))
-        
-        csv_data.seek(0)
-        csv_reader = csv.DictReader(csv_data, delimiter=',')
-        
-        if csv_reader.fieldnames is None:
-            flash('Не удалось прочитать заголовки CSV файла', 'danger')
-            return redirect(url_for('upload_csv'))
-        
-        # Проверяем и нормализуем колонки
-        fieldnames = [col.strip() for col in csv_reader.fieldnames]
-        
-        required_columns = ['Врач', 'Фамилия', 'Кличка', 'Анализ']
-        optional_columns = ['ID пациента', 'Время создания', 'Примечания']
-        
-        # Ищем колонки в файле
-        found_columns = {}
-        for col in required_columns + optional_columns:
-            col_variants = [col, col.lower(), col.upper()]
-            for variant in col_variants:
-                if variant in fieldnames:
-                    found_columns[col] = variant
-                    break
-        
-        # Проверяем обязательные колонки
-        missing_columns = [col for col in required_columns if col not in found_columns]
-        if missing_columns:
-            flash(f'Отсутствуют обязательные колонки: {", ".join(missing_columns)}', 'danger')
-            flash(f'Найдены колонки: {", ".join(fieldnames)}', 'info')
-            return redirect(url_for('upload_csv'))
-        
-        # Обрабатываем данные
-        added_count = skipped_duplicates = skipped_empty = error_count = 0
-        current_datetime = datetime.utcnow()
-        
-        for row_num, row in enumerate(csv_reader, start=2):
-            try:
-                # Получаем данные из строки
-                doctor_name = row.get(found_columns.get('Врач', ''), '').strip()
-                client_surname = row.get(found_columns.get('Фамилия', ''), '').strip()
-                pet_name = row.get(found_columns.get('Кличка', ''), '').strip()
-                analysis_type = row.get(found_columns.get('Анализ', ''), '').strip()
-                
-                patient_id = row.get(found_columns.get('ID пациента', ''), '').strip() if 'ID пациента' in found_columns else ''
-                time_str = row.get(found_columns.get('Время создания', ''), '').strip() if 'Время создания' in found_columns else ''
-                notes = row.get(found_columns.get('Примечания', ''), '').strip() if 'Примечания' in found_columns else ''
-                
-                # Проверяем обязательные поля
-                if not all([doctor_name, client_surname, pet_name, analysis_type]):
-                    skipped_empty += 1
-                    continue
-                
-                # Находим или создаем врача
-                doctor = Doctor.query.filter_by(name=doctor_name).first()
-                if not doctor:
-                    doctor = Doctor(name=doctor_name)
-                    db.session.add(doctor)
-                    db.session.flush()
-                
-                # Обрабатываем время создания
-                creation_time = parse_creation_time(time_str, current_datetime)
-                
-                # Проверяем дубликаты
-                check_date = creation_time.date()
-                existing_analyses = Analysis.query.filter(
-                    db.and_(
-                        Analysis.client_surname == client_surname,
-                        Analysis.pet_name == pet_name,
-                        Analysis.analysis_type == analysis_type,
-                        Analysis.doctor_id == doctor.id,
-                        db.func.date(Analysis.created_at) == check_date
-                    )
-                ).all()
-                
-                # Проверяем точные дубликаты
-                is_duplicate = any(
-                    existing.patient_id == patient_id and existing.notes == notes
-                    for existing in existing_analyses
-                )
-                
-                if is_duplicate:
-                    skipped_duplicates += 1
-                    continue
-                
-                # Создаем новый анализ
-                new_analysis = Analysis(
-                    patient_id=patient_id if patient_id else None,
-                    client_surname=client_surname,
-                    pet_name=pet_name,
-                    analysis_type=analysis_type,
-                    doctor_id=doctor.id,
-                    notes=notes,
-                    status='actual',
-                    is_called=False,
-                    created_at=creation_time,
-                    updated_at=creation_time
-                )
-                
-                db.session.add(new_analysis)
-                added_count += 1
-                
-                if added_count % 50 == 0:
-                    db.session.commit()
-            
-            except Exception as e:
-                error_count += 1
-                continue
-        
+        # Файл сохраняется в UPLOAD_FOLDER и импортируется в фоновом потоке
+        job_id = uuid.uuid4().hex
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f'import_{job_id}.csv')
+        file.save(path)
+        
+        # Кодировка и колонки проверяются сразу, чтобы ошибка формата не ждала очереди
+        with open(path, 'rb') as stream:
+            open_csv_reader(stream)
+        
+        db.session.add(ImportJob(
+            id=job_id,
+            filename=file.filename,
+            path=path,
+            size=os.path.getsize(path),
+            created_by=session.get('username')
+        ))
         db.session.commit()
+        path = None
         
-        # Формируем сообщение об успехе
-        messages = []
-        if added_count > 0:
-            messages.append(f"[SUCCESS] Успешно добавлено {added_count} анализов")
-        else:
-            messages.append("[WARNING] Не удалось добавить анализы")
-        
-        if skipped_duplicates > 0:
-            messages.append(f"пропущено {skipped_duplicates} дубликатов")
-        if skipped_empty > 0:
-            messages.append(f"пропущено {skipped_empty} строк с пустыми полями")
-        if error_count > 0:
-            messages.append(f"ошибок: {error_count}")
-        
-        flash('. '.join(messages), 'success' if added_count > 0 else 'warning')
-        return redirect(url_for('index'))
+        import_executor.submit(run_import_job, job_id)
+        flash('Файл принят. Импорт выполняется в фоне', 'info')
+        return redirect(url_for('upload_csv', job=job_id))
     
     except ValueError as e:
         flash(str(e), 'danger')
         return redirect(url_for('upload_csv'))
     except Exception as e:
+        db.session.rollback()
         flash(f'Ошибка при обработке CSV файла: {str(e)}', 'danger')
         return redirect(url_for('upload_csv'))
+    finally:
+        # Файл без задачи импорта не нужен
+        if path and os.path.exists(path):
+            os.remove(path)
+
+@app.route('/api/import/<job_id>')
+@admin_required  # Только админы и суперадмины
+def api_import_status(job_id):
+    """Состояние фоновой задачи импорта"""
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Задача импорта не найдена'}), 404
+    return jsonify({'success': True, 'data': import_job_data(job)})
 
 # Логи
+def call_events_query(doctor_id=None, called_by='', date_from='', date_to=''):
+    """Звонки из call_event по врачу, пользователю и периоду (даты ДД.ММ.ГГГГ)"""
+    query = CallEvent.query
+    if doctor_id:
+        query = query.filter(CallEvent.doctor_id == doctor_id)
+    if called_by:
+        query = query.filter(CallEvent.called_by == called_by)
+    if date_from:
+        query = query.filter(CallEvent.called_at >= day_range(parse_filter_date(date_from))[0])
+    if date_to:
+        query = query.filter(CallEvent.called_at < day_range(parse_filter_date(date_to))[1])
+    return query
+
+def paginate_call_events(query, cursor, limit):
+    """Keyset-пагинация звонков по (called_at, id) в порядке убывания"""
+    if cursor:
+        # Формат курсора тот же, что у архива: дата и ID последней строки
+        called_at, event_id = decode_archive_cursor(cursor)
+        query = query.filter(db.tuple_(CallEvent.called_at, CallEvent.id) < (called_at, event_id))
+    
+    rows = query.order_by(CallEvent.called_at.desc(), CallEvent.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = f"{rows[-1].called_at.isoformat()}|{rows[-1].id}" if has_more else None
+    return rows, next_cursor
+
 @app.route('/logs')
 @user_or_doctor_required  # Могут все авторизованные пользователи
 def view_logs():
-    log_files = []
-    logs_dir = 'emergency_logs'
-    
-    if os.path.exists(logs_dir):
-        for filename in sorted(os.listdir(logs_dir), reverse=True):
-            if filename.startswith('emergency_') and filename.endswith('.txt'):
-                filepath = os.path.join(logs_dir, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    record_count = content.count('ВЛАДЕЛЕЦ:')
-                    
-                    log_files.append({
-                        'filename': filename,
-                        'date': filename.replace('emergency_', '').replace('.txt', ''),
-                        'content': content,
-                        'record_count': record_count,
-                        'size': os.path.getsize(filepath)
-                    })
-                except Exception as e:
-                    print(f'Ошибка чтения файла {filename}: {e}')
-    
-    return render_template('logs.html', log_files=log_files)
+    """Список лог-файлов: только метаданные, записи дня подгружаются через /api/logs/<day>.
+    
+    С mode=calls вместо файлов показываются звонки из таблицы call_event
+    с фильтрами по периоду, врачу и пользователю.
+    """
+    log_files = list_log_files()
+    
+    page_size = Config.LOGS_PAGE_SIZE
+    pages = max((len(log_files) + page_size - 1) // page_size, 1)
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    
+    call_filters = {
+        'doctor_id': request.args.get('doctor_id', type=int),
+        'called_by': request.args.get('called_by', '').strip(),
+        'date_from': request.args.get('date_from', '').strip(),
+        'date_to': request.args.get('date_to', '').strip(),
+    }
+    calls = next_cursor = None
+    if request.args.get('mode') == 'calls':
+        try:
+            validate_filter_dates(call_filters['date_from'], call_filters['date_to'])
+            calls, next_cursor = paginate_call_events(
+                call_events_query(**call_filters).options(db.joinedload(CallEvent.doctor)),
+                request.args.get('cursor', '').strip(), Config.CALLS_PAGE_SIZE
+            )
+        except ValueError as e:
+            flash(str(e), 'danger')
+            calls = []
+    
+    return render_template('logs.html',
+                           log_files=log_files[(page - 1) * page_size:page * page_size],
+                           total_files=len(log_files),
+                           total_records=sum(log['record_count'] for log in log_files),
+                           total_size=sum(log['size'] for log in log_files),
+                           page=page,
+                           pages=pages,
+                           calls=calls,
+                           next_cursor=next_cursor,
+                           call_filters=call_filters,
+                           doctors=Doctor.query.order_by(Doctor.name).all(),
+                           usernames=[name for name, in db.session.query(User.username).order_by(User.username)])
+
+@app.route('/api/logs/search')
+@user_or_doctor_required  # Могут все авторизованные пользователи
+def api_log_search():
+    """Поиск записей по всем логам звонков (без учета регистра)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if len(query) < 2:
+            raise ValueError('Введите не менее 2 символов для поиска')
+        limit = request.args.get('limit', Config.LOG_SEARCH_LIMIT, type=int)
+        limit = min(max(limit, 1), Config.LOG_SEARCH_LIMIT)
+        
+        results, truncated = search_logs(query, limit)
+        return jsonify({
+            'success': True,
+            'data': {
+                'results': results,
+                'truncated': truncated
+            }
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/logs/<day>')
+@user_or_doctor_required  # Могут все авторизованные пользователи
+def api_log_entries(day):
+    """Страница записей лога за день"""
+    try:
+        if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', day):
+            raise ValueError('Неверная дата лога')
+        
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = request.args.get('limit', Config.LOG_ENTRIES_PAGE_SIZE, type=int)
+        limit = min(max(limit, 1), Config.LOG_ENTRIES_PAGE_SIZE * 10)
+        
+        entries, total = read_log_entries(day, offset, limit)
+        if entries is None:
+            return jsonify({'success': False, 'error': 'Лог за этот день не найден'}), 404
+        next_offset = offset + len(entries)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'entries': entries,
+                'total': total,
+                'next_offset': next_offset if next_offset < total else None
+            }
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/logs/<day>/download')
+@user_or_doctor_required  # Могут все авторизованные пользователи
+def download_log(day):
+    """Скачивание лога дня одним распакованным файлом"""
+    segments = log_day_segments().get(day) if re.fullmatch(r'\d{4}-\d{2}-\d{2}', day) else None
+    if not segments:
+        flash('Лог за этот день не найден', 'warning')
+        return redirect(url_for('view_logs'))
+    
+    extension = 'jsonl' if any('.jsonl' in path for path in segments) else 'txt'
+    return Response(generate_log_day(segments), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=emergency_{day}.{extension}'})
 
 # Экспорт данных
+EXPORT_HEADERS = [
+    'ID', 'ID пациента', 'Фамилия владельца', 'Кличка', 'Тип анализа',
+    'Статус', 'Обработан', 'Дата обработки', 'Врач',
+    'Примечания', 'Дата создания', 'Дата обновления'
+]
+
+EXPORT_COLUMNS = ['id', 'patient_id', 'client_surname', 'pet_name', 'analysis_type', 'status',
+                  'is_called', 'call_date', 'doctor', 'notes', 'created_at', 'updated_at']
+
+# Формат: (MIME-тип, расширение файла)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'feather': ('application/vnd.apache.arrow.file', 'feather'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+def missing_export_package(file_format):
+    """Имя неустановленного пакета, без которого формат экспорта недоступен, или None"""
+    if file_format in ('parquet', 'feather') and pa is None:
+        return 'pyarrow'
+    if file_format == 'xlsx' and openpyxl is None:
+        return 'openpyxl'
+    return None
+
+def available_export_formats():
+    """Форматы экспорта, для которых установлены нужные пакеты"""
+    return [file_format for file_format in EXPORT_FORMATS if missing_export_package(file_format) is None]
+
+def export_query(model, filters=(None, '', '', '', ''), status=''):
+    """Строки экспорта одной таблицы с именем врача, от новых к старым"""
+    query = db.session.query(
+        model.id, model.patient_id, model.client_surname, model.pet_name, model.analysis_type,
+        model.status, model.is_called, model.call_date, Doctor.name.label('doctor'),
+        model.notes, model.created_at, model.updated_at
+    ).outerjoin(Doctor, model.doctor_id == Doctor.id)
+    query = filter_analysis_query(query, model, filters, status)
+    return query.order_by(model.created_at.desc(), model.id.desc())
+
+def iter_export_batches(model, query):
+    """Строки запроса экспорта keyset-пакетами по (created_at, id) от новых к старым.
+    
+    Каждый пакет читается целиком, и транзакция чтения завершается до отдачи
+    строк: медленный клиент не держит блокировку SQLite и не мешает записи.
+    """
+    last = None
+    while True:
+        batch_query = query
+        if last is not None:
+            # Сравнение кортежей SQLite ведет по индексу created_at (created_at<?)
+            batch_query = query.filter(db.tuple_(model.created_at, model.id) < (last.created_at, last.id))
+        rows = batch_query.limit(Config.EXPORT_BATCH_SIZE).all()
+        db.session.rollback()
+        yield from rows
+        if len(rows) < Config.EXPORT_BATCH_SIZE:
+            return
+        last = rows[-1]
+
+def iter_export_rows(filters, status):
+    """Сливает строки рабочей и архивной таблиц в один поток от новых к старым"""
+    streams = [iter_export_batches(model, export_query(model, filters, status)) for model in api_models(status)]
+    return heapq.merge(*streams, key=lambda row: (row.created_at, row.id), reverse=True)
+
+def export_row(row):
+    """Значения строки экспорта в формате выгрузки"""
+    return [
+        row.id,
+        row.patient_id or '',
+        row.client_surname,
+        row.pet_name,
+        row.analysis_type,
+        row.status,
+        'Да' if row.is_called else 'Нет',
+        row.call_date.strftime('%d.%m.%Y %H:%M') if row.call_date else '',
+        row.doctor or '',
+        row.notes or '',
+        row.created_at.strftime('%d.%m.%Y %H:%M'),
+        row.updated_at.strftime('%d.%m.%Y %H:%M')
+    ]
+
+def generate_export_csv(rows):
+    """CSV экспорта по частям: заголовок сразу, затем пакеты по EXPORT_BATCH_SIZE строк"""
+    output = StringIO()
+    writer = csv.writer(output, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    
+    def flush():
+        data = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+        return data
+    
+    writer.writerow(EXPORT_HEADERS)
+    yield flush()
+    
+    for count, row in enumerate(rows, 1):
+        writer.writerow(export_row(row))
+        if count % Config.EXPORT_BATCH_SIZE == 0:
+            yield flush()
+    
+    if output.tell():
+        yield flush()
+
+def write_export_arrow(rows, sink, file_format):
+    """Пишет строки экспорта в Parquet (группа строк на пакет) или Feather (Arrow IPC)"""
+    schema = pa.schema([
+        ('id', pa.int64()), ('patient_id', pa.string()), ('client_surname', pa.string()),
+        ('pet_name', pa.string()), ('analysis_type', pa.string()), ('status', pa.string()),
+        ('is_called', pa.bool_()), ('call_date', pa.timestamp('us')), ('doctor', pa.string()),
+        ('notes', pa.string()), ('created_at', pa.timestamp('us')), ('updated_at', pa.timestamp('us')),
+    ])
+    writer = pq.ParquetWriter(sink, schema) if file_format == 'parquet' else pa.ipc.new_file(sink, schema)
+    try:
+        while True:
+            batch = list(itertools.islice(rows, Config.EXPORT_BATCH_SIZE))
+            if not batch:
+                break
+            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    finally:
+        writer.close()
+
+def write_export_xlsx(rows, sink):
+    """Пишет строки экспорта в XLSX в режиме write-only: строки не держатся в памяти"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Анализы')
+    sheet.append(EXPORT_HEADERS)
+    for row in rows:
+        sheet.append(export_row(row))
+    workbook.save(sink)
+
 @app.route('/export')
 @user_or_doctor_required  # Могут все авторизованные пользователи
 def export_data():
+    """Экспорт анализов с фильтрами главной страницы.
+    
+    CSV передается потоком по мере чтения из базы. Parquet, Feather и XLSX
+    пишутся пакетами во временный файл (оглавление этих форматов находится
+    в конце файла) и отдаются после записи.
+    """
     try:
-        analyses = Analysis.query.order_by(Analysis.created_at.desc()).all()
-        
-        output = StringIO()
-        writer = csv.writer(output, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        
-        writer.writerow([
-            'ID', 'ID пациента', 'Фамилия владельца', 'Кличка', 'Тип анализа',
-            'Статус', 'Обработан', 'Дата обработки', 'Врач',
-            'Примечания', 'Дата создания', 'Дата обновления'
-        ])
-        
-        for analysis in analyses:
-            writer.writerow([
-                analysis.id,
-                analysis.patient_id or '',
-                analysis.client_surname,
-                analysis.pet_name,
-                analysis.analysis_type,
-                analysis.status,
-                'Да' if analysis.is_called else 'Нет',
-                analysis.call_date.strftime('%d.%m.%Y %H:%M') if analysis.call_date else '',
-                analysis.doctor.name if analysis.doctor else '',
-                analysis.notes or '',
-                analysis.created_at.strftime('%d.%m.%Y %H:%M'),
-                analysis.updated_at.strftime('%d.%m.%Y %H:%M')
-            ])
+        doctor_id = request.args.get('doctor_id', type=int)
+        search = request.args.get('search', '').strip()
+        date_filter = request.args.get('date', '').strip()
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        status = request.args.get('status', '').strip()
+        file_format = request.args.get('format', 'csv').strip().lower()
+        
+        if status and status not in API_STATUSES:
+            raise ValueError(f'Неизвестный статус: {status}')
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f'Неизвестный формат экспорта: {file_format}')
+        package = missing_export_package(file_format)
+        if package:
+            raise ValueError(f'Экспорт в формате {file_format} недоступен: установите пакет {package}')
+        validate_filter_dates(date_filter, date_from, date_to)
+        
+        filters = (doctor_id, search, date_filter, date_from, date_to)
+        rows = iter_export_rows(filters, status)
+        mimetype, extension = EXPORT_FORMATS[file_format]
+        filename = f'analytics_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+        
+        if file_format == 'csv':
+            return Response(
+                stream_with_context(generate_export_csv(rows)),
+                mimetype=mimetype,
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
         
-        output.seek(0)
+        # Безымянный временный файл удаляется системой при закрытии после отправки
+        sink = tempfile.TemporaryFile()
+        try:
+            if file_format == 'xlsx':
+                write_export_xlsx(rows, sink)
+            else:
+                write_export_arrow(rows, sink, file_format)
+            sink.seek(0)
+        except Exception:
+            sink.close()
+            raise
         
-        return send_file(
-            BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'analytics_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
+        return send_file(sink, mimetype=mimetype, as_attachment=True, download_name=filename)
+    
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
     
     except Exception as e:
         flash(f'Ошибка при экспорте данных: {str(e)}', 'danger')
@@ -1297,9 +3352,10 @@ def export_data():
 @user_or_doctor_required  # Могут все авторизованные пользователи
 def api_stats():
     try:
-        total = Analysis.query.count()
         actual = Analysis.query.filter_by(status='actual').count()
-        processed = Analysis.query.filter_by(status='processed').count()
+        archived = ArchivedAnalysis.query.count()
+        processed = Analysis.query.filter_by(status='processed').count() + archived
+        total = actual + processed
         
         return jsonify({
             'success': True,
@@ -1307,6 +3363,7 @@ def api_stats():
                 'total': total,
                 'actual': actual,
                 'processed': processed,
+                'archived': archived,
                 'actual_percentage': int((actual / total * 100)) if total > 0 else 0
             }
         })
@@ -1331,6 +3388,7 @@ def add_doctor():
         
         doctor = Doctor(name=name)
         db.session.add(doctor)
+        bump_data_version()
         db.session.commit()
         
         flash(f'Врач {name} успешно добавлен', 'success')
@@ -1345,16 +3403,14 @@ def add_doctor():
 @admin_required  # Только админы и суперадмины
 def reset_all():
     try:
-        analyses = Analysis.query.all()
-        for analysis in analyses:
-            analysis.status = 'actual'
-            analysis.is_called = False
-            analysis.call_date = None
-        
+        count = reset_analyses()
+        record_change('reload')
+        bump_data_version()
         db.session.commit()
-        flash('Все анализы сброшены в статус "Актуальные"', 'info')
+        flash(f'Все анализы сброшены в статус "Актуальные" (изменено {count})', 'info')
     
     except Exception as e:
+        db.session.rollback()
         flash(f'Ошибка при сбросе: {str(e)}', 'danger')
     
     return redirect(url_for('index'))
@@ -1380,11 +3436,15 @@ def reset_database():
             return redirect(url_for('index'))
         
         # Получаем статистику перед удалением
-        total_analyses = Analysis.query.count()
+        total_analyses = Analysis.query.count() + ArchivedAnalysis.query.count()
         total_doctors = Doctor.query.count()
         
-        # Удаляем все данные
+        # Удаляем все данные; внешние базы получат удаление каждого анализа
+        log_changes_where('delete', Analysis)
+        log_changes_where('delete', ArchivedAnalysis)
         Analysis.query.delete()
+        ArchivedAnalysis.query.delete()
+        CallEvent.query.delete()
         Doctor.query.delete()
         
         # Восстанавливаем врачей по умолчанию
@@ -1392,6 +3452,8 @@ def reset_database():
             doctor = Doctor(name=doc_name)
             db.session.add(doctor)
         
+        record_change('reload')
+        bump_data_version()
         db.session.commit()
         
         flash(f'[SUCCESS] База данных успешно сброшена! Удалено {total_analyses} анализов и {total_doctors} врачей. Добавлено {len(Config.DEFAULT_DOCTORS)} врачей по умолчанию.', 'success')
@@ -1405,17 +3467,11 @@ def reset_database():
 @super_admin_required  # Только суперадмин
 def reset_database_page():
     """Страница для сброса базы данных"""
-    current_user = User.query.filter_by(username=session.get('username')).first()
+    current_user = get_current_user()
     total_analyses = Analysis.query.count()
     
     # Подсчет архивных анализов
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    archived_count = Analysis.query.filter(
-        db.and_(
-            Analysis.status == 'processed',
-            Analysis.call_date < week_ago
-        )
-    ).count()
+    archived_count = ArchivedAnalysis.query.count()
     
     doctors_count = Doctor.query.count()
     
@@ -1430,14 +3486,39 @@ def reset_database_page():
 def reset_and_recreate():
     """Сброс и пересоздание базы данных (для отладки)"""
     try:
+        # Запоминаем анализы и курсоры журналов: внешние базы и потоки SSE
+        # продолжают со своих курсоров и должны получить удаление старых анализов
+        tables = set(db.inspect(db.engine).get_table_names())
+        removed_ids = []
+        for model in (Analysis, ArchivedAnalysis):
+            if model.__tablename__ in tables:
+                removed_ids += db.session.scalars(db.select(model.id)).all()
+        last_ids = dict(db.session.execute(
+            db.text('SELECT name, seq FROM sqlite_sequence WHERE name IN (:log, :events)'),
+            {'log': ChangeLog.__tablename__, 'events': ChangeEvent.__tablename__}
+        ).all()) if db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")
+        ).first() else {}
+        db.session.rollback()
+        
         # Удаляем все таблицы
         db.drop_all()
         print("[INFO] Все таблицы удалены")
         
         # Создаем все таблицы заново
         db.create_all()
+        ensure_search_index(rebuild=True)
         print("[INFO] Все таблицы созданы заново")
         
+        # Счетчики AUTOINCREMENT продолжаются с прежних курсоров, а не с 1
+        for table, last_id in last_ids.items():
+            db.session.execute(db.text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                               {'name': table, 'seq': last_id})
+        if removed_ids:
+            log_changes('delete', removed_ids)
+        record_change('reload')
+        db.session.commit()
+        
         # Создаем врачей по умолчанию
         if Doctor.query.count() == 0:
             for doc_name in Config.DEFAULT_DOCTORS:
@@ -1448,6 +3529,8 @@ def reset_and_recreate():
         
         # Создаем администраторов
         create_admin_users()
+        bump_data_version()
+        db.session.commit()
         
         return jsonify({
             'success': True,
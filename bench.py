@@ -0,0 +1,598 @@
+# bench.py - замеры производительности системы учета анализов Malvin Vet
+#
+# Запуск: python bench.py stats --sizes 10000 100000 1000000
+#         python bench.py plans   (завершается с ошибкой при полном сканировании)
+#         python bench.py queries --sizes 100 1000   (число SQL-запросов не зависит от N)
+#         python bench.py import --sizes 20000 100000   (строк в секунду при импорте CSV)
+#         python bench.py stream --sizes 50000 200000   (пик памяти импорта не зависит от размера файла)
+#         python bench.py export --sizes 20000 200000   (первый байт сразу, пик памяти не зависит от N)
+#         python bench.py logs --sizes 30 365   (закрытые дни сжаты, страница логов не зависит от числа дней)
+#         python bench.py logwriter --sizes 1000 10000   (звонок не ждет диска, процессы не перемешивают записи)
+#         python bench.py logsearch --sizes 30 365   (поиск по году логов за миллисекунды, результат совпадает с полным перебором)
+#         python bench.py bulk --sizes 100000   (сброс и архивация одним запросом против цикла по объектам ORM)
+#         python bench.py engines --sizes 20000 100000   (построчный импорт против pandas, результат совпадает)
+# Бенчмарк работает с временной базой SQLite и не трогает рабочую базу.
+import os
+import sys
+import re
+import csv
+import time
+import tracemalloc
+import shutil
+import atexit
+import random
+import tempfile
+import argparse
+import gzip
+import multiprocessing
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+BENCH_DIR = tempfile.mkdtemp(prefix='malvin_bench_')
+atexit.register(shutil.rmtree, BENCH_DIR, ignore_errors=True)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCH_DIR, 'bench.db'))
+
+from app import (app, db, Config, Doctor, Analysis, ArchivedAnalysis, CallEvent, apply_filters,
+                 expired_condition, ensure_indexes, ensure_search_index, get_analysis_statistics,
+                 create_admin_users, bump_data_version, reset_analyses, move_to_archive, backfill_change_log, backfill_call_events, call_events_query, find_csv_columns, import_analysis_rows,
+                 import_analysis_frame, open_csv_stream, parse_creation_time, parse_creation_times,
+                 infer_time_format, emergency_log_record, log_segment_path, compress_closed_logs, lock_log_folder,
+                 log_emergency_call, flush_emergency_log, write_log_batch, log_day_segments,
+                 read_log_entries, search_logs)
+import json
+import pandas as pd
+
+INSERT_CHUNK = 50000
+ANALYSIS_TYPES = ['Кровь', 'Моча', 'Кал', 'Цитология', 'Гистология', 'Вет Юнион', 'Дерматология']
+
+def timed(func, *args, repeat=3):
+    """Лучшее время из нескольких запусков, в миллисекундах"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def populate(size, seed=42):
+    """Заполняет базу size анализами со случайными врачами и статусами"""
+    rnd = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    ensure_indexes()
+    ensure_search_index(rebuild=True)
+
+    for doc_name in Config.DEFAULT_DOCTORS:
+        db.session.add(Doctor(name=doc_name))
+    db.session.commit()
+    doctor_ids = [doctor.id for doctor in Doctor.query.all()]
+
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    batch = []
+    for i in range(size):
+        created_at = now - timedelta(minutes=rnd.randint(0, 60 * 24 * 365))
+        processed = rnd.random() < 0.7
+        call_date = created_at + timedelta(days=rnd.randint(0, 3)) if processed else None
+        # Обработанные у границы архива устаревали бы прямо во время замеров
+        if call_date and abs(call_date - week_ago) < timedelta(hours=1):
+            call_date -= timedelta(hours=2)
+        batch.append({
+            'patient_id': str(100000 + i),
+            'client_surname': f'Клиент{i % 5000}',
+            'pet_name': f'Питомец{i % 300}',
+            'analysis_type': rnd.choice(ANALYSIS_TYPES),
+            'status': 'processed' if processed else 'actual',
+            'is_called': processed,
+            'call_date': call_date,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'doctor_id': rnd.choice(doctor_ids),
+            'notes': ''
+        })
+        if len(batch) >= INSERT_CHUNK:
+            db.session.execute(db.insert(Analysis), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(Analysis), batch)
+    bump_data_version()
+    db.session.commit()
+    backfill_change_log()
+    backfill_call_events()
+
+def non_archive_query(week_ago):
+    return apply_filters(Analysis.query.filter(
+        db.or_(
+            Analysis.status == 'actual',
+            db.and_(Analysis.status == 'processed', Analysis.call_date >= week_ago)
+        )
+    ), '', '')
+
+def legacy_statistics(week_ago, doctors):
+    """Прежний путь: загрузка всех строк и подсчет в Python по каждому врачу"""
+    analyses = non_archive_query(week_ago).all()
+    actual_analyses = [a for a in analyses if a.status == 'actual']
+    processed_analyses = [a for a in analyses if a.status == 'processed']
+    doctor_stats = []
+    for doctor in doctors:
+        doctor_actual = len([a for a in actual_analyses if a.doctor_id == doctor.id])
+        doctor_processed = len([a for a in processed_analyses if a.doctor_id == doctor.id])
+        doctor_stats.append((doctor.id, doctor_actual, doctor_processed))
+    db.session.expunge_all()
+    return doctor_stats
+
+def aggregate_statistics(week_ago, doctors):
+    """Новый путь: один GROUP BY doctor_id, status"""
+    stats = get_analysis_statistics(non_archive_query(week_ago), doctors)
+    return [(stat['id'], stat['actual'], stat['processed']) for stat in stats]
+
+def bench_stats(sizes):
+    print(f"{'строк':>10} | {'Python, мс':>12} | {'GROUP BY, мс':>12} | ускорение")
+    for size in sizes:
+        with app.app_context():
+            populate(size)
+            week_ago = datetime.utcnow() - timedelta(days=7)
+            doctors = Doctor.query.order_by(Doctor.name).all()
+
+            legacy_ms, legacy = timed(legacy_statistics, week_ago, doctors)
+            aggregate_ms, aggregate = timed(aggregate_statistics, week_ago, doctors)
+            assert legacy == aggregate, 'Результаты статистики не совпадают'
+
+            print(f"{size:>10} | {legacy_ms:>12.1f} | {aggregate_ms:>12.1f} | x{legacy_ms / aggregate_ms:.1f}")
+
+# Полный проход таблицы (в том числе по индексу) для запроса с условием WHERE
+FULL_SCAN = re.compile(r'^SCAN (analysis\w*|call_event)\b')
+
+def hot_queries(week_ago, doctor_id):
+    """Запросы главной страницы, архива, статистики и сброса базы"""
+    by_doctor = Analysis.query.filter_by(doctor_id=doctor_id)
+    day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        'index: рабочая таблица': Analysis.query.order_by(Analysis.created_at.desc()),
+        'index: рабочая таблица по врачу': by_doctor.order_by(Analysis.created_at.desc()),
+        'index: перенос в архив': Analysis.query.filter(expired_condition(week_ago)),
+        'index: архив': ArchivedAnalysis.query.order_by(
+            ArchivedAnalysis.call_date.desc(), ArchivedAnalysis.id.desc()),
+        'index: архив по врачу': ArchivedAnalysis.query.filter_by(doctor_id=doctor_id).order_by(
+            ArchivedAnalysis.call_date.desc(), ArchivedAnalysis.id.desc()),
+        'export: следующий пакет': Analysis.query.filter(
+            db.tuple_(Analysis.created_at, Analysis.id) < (day_start, 1)
+        ).order_by(Analysis.created_at.desc(), Analysis.id.desc()),
+        'archive: следующая страница': ArchivedAnalysis.query.filter_by(doctor_id=doctor_id).filter(
+            db.tuple_(ArchivedAnalysis.call_date, ArchivedAnalysis.id) < (day_start, 1)
+        ).order_by(ArchivedAnalysis.call_date.desc(), ArchivedAnalysis.id.desc()),
+        'archive_old': Analysis.query.filter(Analysis.status == 'processed'),
+        'api_stats: актуальные': Analysis.query.filter_by(status='actual'),
+        'api_stats: обработанные': Analysis.query.filter_by(status='processed'),
+        'фильтр по дате': Analysis.query.filter(
+            Analysis.created_at >= day_start, Analysis.created_at < day_start + timedelta(days=1)),
+        'logs: звонки за период': call_events_query(date_from=week_ago.strftime('%d.%m.%Y')).order_by(
+            CallEvent.called_at.desc(), CallEvent.id.desc()),
+        'logs: звонки врача за период': call_events_query(doctor_id, date_from=week_ago.strftime('%d.%m.%Y')).order_by(
+            CallEvent.called_at.desc(), CallEvent.id.desc()),
+        'logs: звонки пользователя': call_events_query(called_by='Malvin_42').order_by(
+            CallEvent.called_at.desc(), CallEvent.id.desc()),
+        'logs: следующая страница звонков врача': call_events_query(doctor_id).filter(
+            db.tuple_(CallEvent.called_at, CallEvent.id) < (day_start, 1)
+        ).order_by(CallEvent.called_at.desc(), CallEvent.id.desc()),
+        'проверка дубликатов': Analysis.query.filter(
+            Analysis.client_surname == 'Клиент1', Analysis.pet_name == 'Питомец1',
+            Analysis.analysis_type == 'Кровь', Analysis.doctor_id == doctor_id,
+            Analysis.created_at >= day_start, Analysis.created_at < day_start + timedelta(days=1)),
+    }
+
+def explain(query):
+    """Возвращает строки EXPLAIN QUERY PLAN для ORM-запроса"""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = compiled.construct_params()
+    positional = tuple(params[name] for name in compiled.positiontup)
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), positional).all()
+    return [row[-1] for row in rows]
+
+def bench_plans(sizes):
+    failures = 0
+    with app.app_context():
+        populate(min(sizes))
+        week_ago = datetime.utcnow() - timedelta(days=7)
+        doctor_id = Doctor.query.first().id
+
+        for name, query in hot_queries(week_ago, doctor_id).items():
+            plan = explain(query)
+            full_scan = query.whereclause is not None and any(FULL_SCAN.match(step) for step in plan)
+            failures += full_scan
+            print(f"[{'FAIL' if full_scan else 'OK'}] {name}: {'; '.join(plan)}")
+
+    if failures:
+        sys.exit(f"Полное сканирование таблицы в {failures} запросах")
+
+QUERY_COUNT_ROUTES = ['/', '/export', '/api/archive?limit=200', '/api/analyses?limit=200',
+                      '/api/changes?limit=200', '/logs?mode=calls']
+
+def count_queries(client, url):
+    """Выполняет GET-запрос и считает SQL-запросы, отправленные в базу"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+        assert response.status_code == 200, f'{url}: HTTP {response.status_code}'
+        response.get_data()  # Потоковые ответы выполняют запросы при чтении тела
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+def bench_queries(sizes):
+    counts = {}
+    for size in sizes:
+        with app.app_context():
+            populate(size)
+            create_admin_users()
+        
+        client = app.test_client()
+        client.post('/login', data={
+            'username': Config.SUPER_ADMIN_USERNAME,
+            'password': Config.SUPER_ADMIN_PASSWORD
+        })
+        client.get('/')  # первый заход переносит устаревшие анализы в архив
+        
+        counts[size] = [count_queries(client, url) for url in QUERY_COUNT_ROUTES]
+        
+        # Экспорт читает каждую таблицу keyset-пакетами: один запрос на пакет ожидаем,
+        # последний пакет неполный (или пустой)
+        with app.app_context():
+            batches = sum(model.query.count() // Config.EXPORT_BATCH_SIZE + 1
+                          for model in (Analysis, ArchivedAnalysis))
+        counts[size][QUERY_COUNT_ROUTES.index('/export')] -= batches
+        print(f"{size:>10} строк | " + ' | '.join(
+            f"{url}: {count}" for url, count in zip(QUERY_COUNT_ROUTES, counts[size])))
+    
+    if len(set(map(tuple, counts.values()))) > 1:
+        sys.exit('Число запросов зависит от количества анализов (N+1)')
+
+def make_csv_rows(size, duplicate_share=0.1, seed=7):
+    """Строки CSV в формате выгрузки лаборатории; часть строк повторяется внутри файла"""
+    rnd = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=30)
+    rows = []
+    for _ in range(size):
+        if rows and rnd.random() < duplicate_share:
+            rows.append(dict(rnd.choice(rows)))
+            continue
+        created_at = start + timedelta(minutes=rnd.randint(0, 60 * 24 * 30))
+        rows.append({
+            'Врач': rnd.choice(Config.DEFAULT_DOCTORS),
+            'Фамилия': f'Клиент{rnd.randint(0, 50000)}',
+            'Кличка': f'Питомец{rnd.randint(0, 300)}',
+            'Анализ': rnd.choice(ANALYSIS_TYPES),
+            'ID пациента': str(rnd.randint(100000, 999999)),
+            'Время создания': created_at.strftime('%d.%m.%Y %H:%M'),
+            'Примечания': ''
+        })
+    return rows
+
+def bench_import(sizes):
+    print(f"{'строк':>10} | {'импорт, строк/с':>16} | {'добавлено':>10} | {'повторный импорт, строк/с':>26}")
+    for size in sizes:
+        rows = make_csv_rows(size)
+        found_columns = find_csv_columns(list(rows[0]))
+        with app.app_context():
+            populate(0)
+            first = import_analysis_rows(iter(rows), found_columns)
+            assert first['added'] + first['duplicates'] == size, 'Потеряны строки импорта'
+            assert first['duplicates'] > 0, 'Дубликаты внутри файла не найдены'
+            
+            # Повторный импорт того же файла: все строки - дубликаты из базы
+            second = import_analysis_rows(iter(rows), found_columns)
+            assert second['added'] == 0, 'Повторный импорт добавил строки'
+            
+            print(f"{size:>10} | {first['rate']:>16.0f} | {first['added']:>10} | {second['rate']:>26.0f}")
+
+def write_csv_file(size, encoding='utf-8'):
+    """Пишет CSV-файл размером size строк во временный каталог бенчмарка"""
+    path = os.path.join(BENCH_DIR, f'import_{size}.csv')
+    rows = make_csv_rows(size)
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+def bench_stream(sizes):
+    peaks = {}
+    print(f"{'строк':>10} | {'файл, МБ':>9} | {'строк/с':>8} | {'пик памяти, МБ':>15}")
+    for size in sizes:
+        path = write_csv_file(size)
+        with app.app_context():
+            populate(0)
+            with open(path, 'rb') as stream:
+                tracemalloc.start()
+                reader = csv.DictReader(open_csv_stream(stream))
+                stats = import_analysis_rows(reader, find_csv_columns(reader.fieldnames))
+                peaks[size] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+        
+        file_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"{size:>10} | {file_mb:>9.1f} | {stats['rate']:>8.0f} | {peaks[size]:>15.1f}")
+    
+    smallest, largest = min(sizes), max(sizes)
+    if peaks[largest] > peaks[smallest] * 1.5:
+        sys.exit('Пик памяти импорта растет с размером файла')
+
+def bench_engines(sizes):
+    print(f"{'строк':>10} | {'построчно, строк/с':>19} | {'pandas, строк/с':>16} | {'ускорение':>9} | "
+          f"{'разбор времени: strptime, с':>28} | {'pandas, с':>9}")
+    for size in sizes:
+        path = write_csv_file(size)
+        
+        # Разбор 'Время создания' отдельно от вставки в базу
+        values = [row['Время создания'] for row in make_csv_rows(size)]
+        now = datetime.utcnow()
+        started = time.perf_counter()
+        expected = [parse_creation_time(value, now) for value in values]
+        strptime_time = time.perf_counter() - started
+        started = time.perf_counter()
+        series = pd.Series(values)
+        parsed = parse_creation_times(series, infer_time_format(series), now)
+        pandas_time = time.perf_counter() - started
+        assert parsed.tolist() == expected, 'Векторный разбор времени расходится со strptime'
+        
+        results = {}
+        for engine in ('rows', 'pandas'):
+            with app.app_context():
+                populate(0)
+                with open(path, 'rb') as stream:
+                    if engine == 'rows':
+                        reader = csv.DictReader(open_csv_stream(stream))
+                        stats = import_analysis_rows(reader, find_csv_columns(reader.fieldnames))
+                    else:
+                        stats = import_analysis_frame(open_csv_stream(stream))
+                results[engine] = stats
+                # Повторный импорт: все строки - дубликаты из базы
+                with open(path, 'rb') as stream:
+                    again = import_analysis_frame(open_csv_stream(stream))
+                assert again['added'] == 0, 'Повторный импорт добавил строки'
+        
+        rows, frame = results['rows'], results['pandas']
+        for key in ('rows', 'added', 'duplicates', 'empty', 'errors'):
+            assert rows[key] == frame[key], f"Движки импорта расходятся по '{key}': {rows[key]} != {frame[key]}"
+        print(f"{size:>10} | {rows['rate']:>19.0f} | {frame['rate']:>16.0f} | {frame['rate'] / rows['rate']:>8.1f}x | "
+              f"{strptime_time:>28.2f} | {pandas_time:>9.2f}")
+
+def bench_export(sizes):
+    peaks = {}
+    print(f"{'строк':>10} | {'первый байт, мс':>15} | {'всего, с':>8} | {'МБ':>6} | {'пик памяти, МБ':>15}")
+    for size in sizes:
+        with app.app_context():
+            populate(size)
+            create_admin_users()
+        
+        client = app.test_client()
+        client.post('/login', data={
+            'username': Config.SUPER_ADMIN_USERNAME,
+            'password': Config.SUPER_ADMIN_PASSWORD
+        })
+        
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = client.get('/export', buffered=False)
+        chunks = iter(response.response)
+        total = len(next(chunks))
+        first_byte = time.perf_counter() - started
+        for chunk in chunks:
+            total += len(chunk)
+        elapsed = time.perf_counter() - started
+        peaks[size] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        response.close()
+        
+        print(f"{size:>10} | {first_byte * 1000:>15.1f} | {elapsed:>8.2f} | {total / 1024 / 1024:>6.1f} | {peaks[size]:>15.1f}")
+    
+    smallest, largest = min(sizes), max(sizes)
+    if peaks[largest] > peaks[smallest] * 1.5:
+        sys.exit('Пик памяти экспорта растет с количеством анализов')
+
+def write_log_files(days, entries_per_day=200):
+    """Пишет JSONL-логи звонков за days дней в каталог бенчмарка и сжимает закрытые дни"""
+    Config.EMERGENCY_LOGS_FOLDER = os.path.join(BENCH_DIR, f'logs_{days}')
+    os.makedirs(Config.EMERGENCY_LOGS_FOLDER, exist_ok=True)
+    doctor = Doctor(id=1, name=Config.DEFAULT_DOCTORS[0])
+    today = datetime.now().date()
+    raw_size = 0
+    for day in range(days):
+        with open(log_segment_path((today - timedelta(days=day)).isoformat()), 'wb') as f:
+            for i in range(entries_per_day):
+                analysis = Analysis(id=i, client_surname=f'Клиент{i}', pet_name='Питомец', analysis_type='Кровь',
+                                    doctor=doctor, doctor_id=1, created_at=datetime.utcnow())
+                line = json.dumps(emergency_log_record(analysis, 'bench'), ensure_ascii=False) + '\n'
+                raw_size += f.write(line.encode('utf-8'))
+    with lock_log_folder():
+        compress_closed_logs(today.isoformat())
+    return raw_size
+
+def bench_logs(sizes):
+    with app.app_context():
+        populate(0)
+        create_admin_users()
+    client = app.test_client()
+    client.post('/login', data={
+        'username': Config.SUPER_ADMIN_USERNAME,
+        'password': Config.SUPER_ADMIN_PASSWORD
+    })
+    
+    print(f"{'дней':>6} | {'JSONL, КБ':>9} | {'на диске, КБ':>12} | {'/logs, мс':>10} | {'страница записей (.gz), мс':>27}")
+    for days in sizes:
+        with app.app_context():
+            raw_size = write_log_files(days)
+        compressed = sum(name.endswith('.gz') for name in os.listdir(Config.EMERGENCY_LOGS_FOLDER))
+        assert compressed == days - 1, 'Закрытые дни не сжаты'
+        
+        started = time.perf_counter()
+        assert client.get('/logs').status_code == 200
+        page = time.perf_counter() - started
+        
+        day = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+        started = time.perf_counter()
+        data = client.get(f'/api/logs/{day}?offset=100').get_json()['data']
+        entries = time.perf_counter() - started
+        assert data['total'] == 200 and len(data['entries']) == Config.LOG_ENTRIES_PAGE_SIZE
+        
+        disk = sum(entry.stat().st_size for entry in os.scandir(Config.EMERGENCY_LOGS_FOLDER))
+        print(f"{days:>6} | {raw_size / 1024:>9.0f} | {disk / 1024:>12.0f} | {page * 1000:>10.1f} | {entries * 1000:>27.1f}")
+
+def bench_log_record(i):
+    doctor = Doctor(id=1, name=Config.DEFAULT_DOCTORS[0])
+    analysis = Analysis(id=i, client_surname=f'Клиент{i}', pet_name='Питомец', analysis_type='Кровь',
+                        doctor=doctor, doctor_id=1, created_at=datetime.utcnow())
+    return emergency_log_record(analysis, 'bench')
+
+def log_calls(first, count):
+    """Звонки одного процесса: записи ставятся в очередь и дописываются до выхода"""
+    for i in range(first, first + count):
+        log_emergency_call(bench_log_record(i))
+    flush_emergency_log()
+
+def bench_logwriter(sizes, processes=4):
+    print(f"{'звонков':>8} | {'запись в запросе, мкс':>21} | {'очередь, мкс':>12} | {'дозапись очереди, мс':>20} | {'процессов':>9}")
+    for size in sizes:
+        Config.EMERGENCY_LOGS_FOLDER = os.path.join(BENCH_DIR, f'writer_{size}_sync')
+        os.makedirs(Config.EMERGENCY_LOGS_FOLDER)
+        records = [bench_log_record(i) for i in range(size)]
+        # Прежнее поведение: открыть, дописать и закрыть файл в каждом запросе (без fsync)
+        started = time.perf_counter()
+        for record in records:
+            write_log_batch([(json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')], sync=False)
+        direct = time.perf_counter() - started
+        
+        Config.EMERGENCY_LOGS_FOLDER = os.path.join(BENCH_DIR, f'writer_{size}')
+        os.makedirs(Config.EMERGENCY_LOGS_FOLDER)
+        started = time.perf_counter()
+        for record in records:
+            log_emergency_call(record)
+        queued = time.perf_counter() - started
+        started = time.perf_counter()
+        flush_emergency_log()
+        drained = time.perf_counter() - started
+        
+        # Несколько процессов пишут в один файл дня одновременно
+        Config.EMERGENCY_LOGS_FOLDER = os.path.join(BENCH_DIR, f'writer_{size}_mp')
+        os.makedirs(Config.EMERGENCY_LOGS_FOLDER)
+        share = size // processes
+        workers = [multiprocessing.get_context('fork').Process(target=log_calls, args=(n * share, share))
+                   for n in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        
+        day = datetime.now().date().isoformat()
+        ids = []
+        for path in log_day_segments()[day]:
+            with open(path, 'rb') as f:
+                ids.extend(json.loads(line)['analysis_id'] for line in f)
+        entries, total = read_log_entries(day, 0, processes * share)
+        assert sorted(ids) == list(range(processes * share)), 'Записи процессов потеряны или перемешаны'
+        assert total == len(entries) == len(ids), 'Индекс не совпадает с файлом лога'
+        
+        print(f"{size:>8} | {direct / size * 1e6:>21.1f} | {queued / size * 1e6:>12.1f} | {drained * 1000:>20.1f} | {processes:>9}")
+
+def bench_logsearch(sizes):
+    print(f"{'дней':>6} | {'первый поиск, мс':>16} | {'повторный, мс':>13} | {'нет совпадений, мс':>18} | {'найдено':>7}")
+    for days in sizes:
+        with app.app_context():
+            write_log_files(days)
+        
+        started = time.perf_counter()
+        results, _ = search_logs('КЛИЕНТ77', days * 10)
+        cold = time.perf_counter() - started
+        warm, _ = timed(search_logs, 'клиент77', days * 10)
+        missing, (nothing, _) = timed(search_logs, 'Несуществующий', 100)
+        
+        # Полный перебор записей для сверки
+        expected = 0
+        for segments in log_day_segments().values():
+            for path in segments:
+                with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+                    expected += sum(json.loads(line)['client_surname'] == 'Клиент77' for line in f)
+        assert len(results) == expected == days, 'Поиск нашел не те записи'
+        assert all(entry['record']['client_surname'] == 'Клиент77' for entry in results)
+        assert [entry['date'] for entry in results] == sorted((entry['date'] for entry in results), reverse=True)
+        assert not nothing
+        
+        print(f"{days:>6} | {cold * 1000:>16.1f} | {warm:>13.1f} | {missing:>18.1f} | {len(results):>7}")
+
+def legacy_reset_all():
+    """Прежний путь: загрузка всех анализов и сброс каждого объекта ORM"""
+    analyses = Analysis.query.all()
+    for analysis in analyses:
+        analysis.status = 'actual'
+        analysis.is_called = False
+        analysis.call_date = None
+    db.session.commit()
+    db.session.expunge_all()
+    return len(analyses)
+
+def bulk_reset_all():
+    count = reset_analyses()
+    db.session.commit()
+    return count
+
+def bulk_archive_old():
+    count = move_to_archive(Analysis.status == 'processed')
+    db.session.commit()
+    return count
+
+def timed_once(size, func):
+    """Время одного запуска на свежей базе (операции меняют данные), в миллисекундах"""
+    populate(size)
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+def bench_bulk(sizes):
+    print(f"{'строк':>10} | {'операция':>11} | {'цикл ORM, мс':>12} | {'один запрос, мс':>15} | {'ускорение':>9} | {'строк изменено':>14}")
+    for size in sizes:
+        with app.app_context():
+            legacy_ms, legacy_count = timed_once(size, legacy_reset_all)
+            bulk_ms, count = timed_once(size, bulk_reset_all)
+            assert Analysis.query.filter(db.or_(Analysis.status != 'actual', Analysis.is_called.is_(True))).count() == 0, \
+                'Сброс затронул не все анализы'
+            print(f"{size:>10} | {'reset_all':>11} | {legacy_ms:>12.0f} | {bulk_ms:>15.0f} | x{legacy_ms / bulk_ms:>8.1f} | {count:>14}")
+            
+            # Прежний archive_old только сдвигал call_date свежих анализов, теперь строки
+            # переносятся в архивную таблицу, поэтому сравнения с циклом нет
+            bulk_ms, count = timed_once(size, bulk_archive_old)
+            assert count == ArchivedAnalysis.query.count() and Analysis.query.filter_by(status='processed').count() == 0
+            print(f"{size:>10} | {'archive_old':>11} | {'-':>12} | {bulk_ms:>15.0f} | {'-':>9} | {count:>14}")
+
+BENCHMARKS = {
+    'stats': bench_stats,
+    'plans': bench_plans,
+    'queries': bench_queries,
+    'import': bench_import,
+    'stream': bench_stream,
+    'export': bench_export,
+    'engines': bench_engines,
+    'logs': bench_logs,
+    'logwriter': bench_logwriter,
+    'logsearch': bench_logsearch,
+    'bulk': bench_bulk,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарки Malvin Vet')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"База бенчмарка: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    BENCHMARKS[args.benchmark](args.sizes)
+    sys.stdout.flush()
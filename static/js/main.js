@@ -1,5 +1,14 @@
 // Основная инициализация и общие функции
 document.addEventListener('DOMContentLoaded', function() {
+    // Ленивая подгрузка архива (до восстановления вкладки)
+    initArchiveTab();
+    
+    // Живое обновление строк по событиям сервера
+    initLiveUpdates();
+    
+    // Действия со строками через fetch
+    initRowActionForms();
+    
     // Сохранение активной вкладки
     initTabPersistence();
     
@@ -25,6 +34,194 @@ function initTabPersistence() {
     }
 }
 
+function initArchiveTab() {
+    const pane = document.getElementById('archived-content');
+    const tab = document.getElementById('archived-tab');
+    const rows = document.getElementById('archivedRows');
+    if (!pane || !tab || !rows) return;
+    
+    const spinner = document.getElementById('archiveSpinner');
+    const loadMore = document.getElementById('archiveLoadMore');
+    let nextCursor = null;
+    let loaded = false;
+    let loading = false;
+    
+    function loadPage() {
+        if (loading) return;
+        loading = true;
+        spinner.classList.remove('d-none');
+        loadMore.classList.add('d-none');
+        
+        const url = new URL(pane.dataset.archiveUrl, window.location.origin);
+        if (nextCursor) {
+            url.searchParams.set('cursor', nextCursor);
+        }
+        
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(result => {
+                if (!result.success) throw new Error(result.error);
+                rows.insertAdjacentHTML('beforeend', result.data.html);
+                nextCursor = result.data.next_cursor;
+                loadMore.classList.toggle('d-none', !nextCursor);
+            })
+            .catch(error => {
+                console.error('Ошибка загрузки архива:', error);
+                loadMore.classList.remove('d-none');
+            })
+            .finally(() => {
+                loading = false;
+                spinner.classList.add('d-none');
+            });
+    }
+    
+    tab.addEventListener('shown.bs.tab', function() {
+        if (loaded) return;
+        loaded = true;
+        loadPage();
+    });
+    loadMore.addEventListener('click', loadPage);
+}
+
+function initLiveUpdates() {
+    const content = document.getElementById('analysisTabContent');
+    if (!content || !content.dataset.eventsUrl || !window.EventSource) return;
+    
+    const MAX_ROWS = 200;  // Config.LIVE_ROWS_LIMIT
+    const pendingIds = new Set();
+    let timer = null;
+    
+    const source = new EventSource(content.dataset.eventsUrl);
+    source.addEventListener('change', function(event) {
+        const change = JSON.parse(event.data);
+        if (change.analysis_id === null) {
+            // Массовое изменение (импорт, сброс) на месте не применяется
+            showReloadNotice();
+            return;
+        }
+        pendingIds.add(change.analysis_id);
+        
+        // События одной операции собираются в один запрос
+        clearTimeout(timer);
+        timer = setTimeout(applyChanges, 300);
+    });
+    
+    function applyChanges() {
+        const ids = Array.from(pendingIds);
+        pendingIds.clear();
+        if (ids.length > MAX_ROWS) {
+            showReloadNotice();
+            return;
+        }
+        
+        const url = new URL(content.dataset.rowsUrl, window.location.origin);
+        url.searchParams.set('ids', ids.join(','));
+        
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(result => {
+                if (!result.success) throw new Error(result.error);
+                result.data.rows.forEach(applyRowUpdate);
+                updateTabCounters(result.data.counts);
+            })
+            .catch(error => console.error('Ошибка живого обновления:', error));
+    }
+}
+
+// Действия со строкой (звонок, архив, удаление) без перезагрузки страницы
+function initRowActionForms() {
+    document.addEventListener('submit', function(event) {
+        const form = event.target;
+        if (!form.classList.contains('row-action-form')) return;
+        event.preventDefault();
+        submitRowAction(form);
+    });
+}
+
+function submitRowAction(form) {
+    return fetch(form.action, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: { 'Accept': 'application/json' }
+    })
+        .then(response => response.json())
+        .then(result => {
+            if (result.data) {
+                applyRowUpdate(result.data.row);
+                updateTabCounters(result.data.counts);
+            }
+            showActionMessage(result.message, result.category);
+        })
+        .catch(error => {
+            // Если JSON-ответ не получен, отправляем форму обычным способом
+            console.error('Ошибка выполнения действия:', error);
+            form.submit();
+        });
+}
+
+function applyRowUpdate(row) {
+    const target = row.tab ? document.getElementById(row.tab + 'Rows') : null;
+    const existing = document.querySelectorAll(`tr[data-analysis-row="${row.id}"]`);
+    let html = row.html;
+    
+    existing.forEach(tr => {
+        // Строка осталась в той же вкладке: заменяем на месте
+        if (target && html && tr.parentElement === target) {
+            tr.outerHTML = html;
+            html = '';
+        } else {
+            tr.remove();
+        }
+    });
+    
+    if (!html || row.tab === 'archived') return;  // архив подгружается по запросу
+    if (!target) {
+        // Вкладка была пустой, таблицы на странице нет
+        showReloadNotice();
+        return;
+    }
+    target.insertAdjacentHTML('afterbegin', html);
+}
+
+function updateTabCounters(counts) {
+    ['actual', 'processed', 'archived'].forEach(tab => {
+        const badge = document.getElementById(tab + 'Count');
+        if (badge) badge.textContent = counts[tab];
+    });
+}
+
+function showActionMessage(message, category) {
+    const container = document.getElementById('actionMessages');
+    if (!container || !message) return;
+    
+    const icons = { success: 'check-circle', danger: 'exclamation-triangle' };
+    const alert = document.createElement('div');
+    alert.className = `alert alert-${category} alert-dismissible fade show mb-4`;
+    alert.setAttribute('role', 'alert');
+    alert.innerHTML = `<i class="bi bi-${icons[category] || 'info-circle'} me-2"></i>` +
+        '<span></span><button type="button" class="btn-close" data-bs-dismiss="alert"></button>';
+    alert.querySelector('span').textContent = message;
+    container.prepend(alert);
+    
+    setTimeout(() => bootstrap.Alert.getOrCreateInstance(alert).close(), 5000);
+}
+
+function showReloadNotice() {
+    const content = document.getElementById('analysisTabContent');
+    if (!content || document.getElementById('liveReloadNotice')) return;
+    
+    const notice = document.createElement('div');
+    notice.id = 'liveReloadNotice';
+    notice.className = 'alert alert-info';
+    notice.innerHTML = '<i class="bi bi-arrow-repeat me-2"></i>Данные изменились. ' +
+        '<a href="#" class="alert-link">Обновить страницу</a>';
+    notice.querySelector('a').addEventListener('click', function(event) {
+        event.preventDefault();
+        window.location.reload();
+    });
+    content.parentNode.insertBefore(notice, content);
+}
+
 function initAutoDismissAlerts() {
     const alerts = document.querySelectorAll('.alert');
     alerts.forEach(alert => {
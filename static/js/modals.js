@@ -12,7 +12,8 @@ class ModalHandler {
         const confirmButton = document.getElementById('confirmCallButton');
         if (confirmButton) {
             confirmButton.addEventListener('click', () => {
-                document.getElementById('confirmCallForm').submit();
+                bootstrap.Modal.getInstance(modal).hide();
+                submitRowAction(document.getElementById('confirmCallForm'));
             });
         }
     }
@@ -29,7 +30,8 @@ class ModalHandler {
         const confirmButton = document.getElementById('confirmDeleteButton');
         if (confirmButton) {
             confirmButton.addEventListener('click', () => {
-                document.getElementById('confirmDeleteForm').submit();
+                bootstrap.Modal.getInstance(modal).hide();
+                submitRowAction(document.getElementById('confirmDeleteForm'));
             });
         }
     }